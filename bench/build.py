@@ -0,0 +1,170 @@
+'''Time Generator.update on a synthetic site.
+
+    python bench/build.py [options]
+
+Writes a synthetic site (see bench/synthetic.py) to a temporary directory
+and times, each the best of --repeat runs:
+
+    cold      a first build, with no output, manifest or caches
+    noop      a build with nothing changed
+    edit      a build after one page changed
+    template  a build after the template every page uses changed
+
+Each build is run by a new Generator, as the command line would. The
+results are appended as a line of JSON to --output, and --compare prints
+them against the last line of an earlier results file, exiting with 1 if
+any scenario is more than --threshold times slower.
+'''
+import os, sys, json, time, shutil, logging, platform, tempfile, subprocess
+from argparse import ArgumentParser
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from pagepress.generator import Generator
+from synthetic import Site
+
+SCENARIOS = ('cold', 'noop', 'edit', 'template')
+
+
+class Config(dict):
+    '''The generator's config, answering both config.get(key) and
+    config.get('pagepress:main', key).'''
+    def get(self, section, key=None):
+        if section == 'pagepress:main':
+            return self[key]
+        return dict.get(self, section, key)
+
+
+def generator(base, **settings):
+    config = Config(base=base, source='source', static='html', data='data',
+                    template_debugging=False, stop_on_error=True)
+    config.update(settings)
+    return Generator(config)
+
+
+def timed(base, settings):
+    start = time.perf_counter()
+    result = generator(base, **settings).update()
+    return time.perf_counter() - start, result
+
+
+def run(site, base, settings, repeat):
+    '''Time each scenario, returning {scenario: {...}}.'''
+    times = dict((scenario, []) for scenario in SCENARIOS)
+    results = {}
+    for i in range(repeat):
+        for directory in ('html', 'data'):
+            shutil.rmtree(os.path.join(base, directory), ignore_errors=True)
+        for scenario in SCENARIOS:
+            if scenario == 'edit':
+                site.edit_page(base, i % site.pages)
+            elif scenario == 'template':
+                site.edit_template(base)
+            seconds, result = timed(base, settings)
+            times[scenario].append(seconds)
+            results[scenario] = result
+    summary = {}
+    for scenario in SCENARIOS:
+        ordered = sorted(times[scenario])
+        summary[scenario] = {
+            'best': ordered[0],
+            'median': ordered[len(ordered) // 2],
+            'written': len(results[scenario].written),
+            'skipped': len(results[scenario].skipped),
+        }
+    return summary
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(record, baseline, threshold):
+    '''Print record against baseline, returning whether any scenario
+    regressed by more than threshold.'''
+    regressed = False
+    print('%-10s %10s %10s %8s' % ('scenario', 'baseline', 'now', 'ratio'))
+    for scenario in SCENARIOS:
+        old = baseline['results'].get(scenario)
+        new = record['results'][scenario]
+        if old is None:
+            continue
+        ratio = new['best'] / old['best'] if old['best'] else 0
+        flag = ''
+        if ratio > threshold:
+            regressed = True
+            flag = ' SLOWER'
+        print('%-10s %9.3fs %9.3fs %7.2fx%s' % (scenario, old['best'],
+                                                new['best'], ratio, flag))
+    if baseline.get('site') != record['site'] or \
+            baseline.get('settings') != record['settings']:
+        print('(the baseline was run with different parameters)')
+    return regressed
+
+
+def main(argv):
+    parser = ArgumentParser(prog='bench/build.py')
+    defaults = Site()
+    for name in ('pages', 'depth', 'fanout', 'templates', 'loops',
+                 'paragraphs', 'assets'):
+        parser.add_argument('--' + name, type=int,
+                            default=getattr(defaults, name))
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--low-memory', action='store_true')
+    parser.add_argument('--compress', default='gzip:9')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Append the results to this file')
+    parser.add_argument('--compare', help='Compare with the last results '
+                        'in this file')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    parser.add_argument('--keep', help='Build the site in this directory, '
+                        'and leave it there')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    site = Site(pages=args.pages, depth=args.depth, fanout=args.fanout,
+                templates=args.templates, loops=args.loops,
+                paragraphs=args.paragraphs, assets=args.assets)
+    settings = {'jobs': args.jobs, 'low_memory': args.low_memory,
+                'compress': args.compress}
+    base = args.keep or tempfile.mkdtemp(prefix='pagepress-bench-')
+    try:
+        site.write(base)
+        results = run(site, base, settings, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(base)
+
+    record = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit(),
+        'python': platform.python_version(),
+        'site': site.parameters(),
+        'settings': settings,
+        'results': results,
+    }
+    for scenario in SCENARIOS:
+        result = results[scenario]
+        print('%-10s %9.3fs best %9.3fs median %7d written %7d skipped' % (
+            scenario, result['best'], result['median'], result['written'],
+            result['skipped']))
+    if args.output:
+        with open(args.output, 'a') as fp:
+            fp.write(json.dumps(record, sort_keys=True) + '\n')
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.loads(fp.read().strip().splitlines()[-1])
+        if compare(record, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+'''Benchmark the pooled Markdown parser against a converter per page.
+
+    python bench/markdown_parser.py [pages] [paragraphs per page]
+
+Converts synthetic Markdown documents (2,000 pages by default) by
+building a new markdown.Markdown for each, as the parser used to, then
+through pagepress.parsers.Markdown's pool and its convert_many batch.
+'''
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from markdown import Markdown as MarkdownParser
+from pagepress.markdown_image import ImageExtension
+from pagepress.parsers import Markdown
+
+
+PARAGRAPH = '''Some *emphasised* text with a [link][ref%(n)d] and `code`,
+followed by a list:
+
+* one
+* two **strong**
+
+| a | b |
+|---|---|
+| %(n)d | x |
+
+[ref%(n)d]: images/%(n)d.png "Image %(n)d"
+'''
+
+
+def documents(pages, paragraphs):
+    return ['# Page %d\n\n' % i +
+            '\n'.join(PARAGRAPH % {'n': i * paragraphs + p}
+                      for p in range(paragraphs))
+            for i in range(pages)]
+
+
+def per_page(texts):
+    for text in texts:
+        MarkdownParser(output_format='html',
+                       extensions=['tables', ImageExtension()]).convert(text)
+
+
+def timed(name, func, texts, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(texts)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('%-14s %6d pages %8.3fs %8.1f pages/s' %
+          (name, len(texts), best, len(texts) / best))
+    return best
+
+
+def main(argv):
+    pages = int(argv[0]) if argv else 2000
+    paragraphs = int(argv[1]) if len(argv) > 1 else 1
+    texts = documents(pages, paragraphs)
+    parser = Markdown(generator=None)
+    old = timed('per page', per_page, texts)
+    pooled = timed('pooled', lambda t: [parser.convert(x) for x in t], texts)
+    batch = timed('convert_many', parser.convert_many, texts)
+    print('speedup        %.1fx pooled, %.1fx batch' %
+          (old / pooled, old / batch))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
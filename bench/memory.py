@@ -0,0 +1,125 @@
+'''Compare the memory held by parsed pages in the old and new page models.
+
+    python bench/memory.py [pages ...]
+
+Builds Blog pages (10,000 and 100,000 by default) the way
+Generator.parse_page does, with the page model as it was before slots
+(a __dict__ per page, a list path, the content held until render) and
+with pagepress.page, which releases the content once it is in the parse
+cache. Reports the memory traced while the pages are alive.
+'''
+import os, sys, gc, datetime, functools, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from pagepress import page
+
+
+class OldFile(object):
+    def __init__(self, generator, path, mtime, content, **metadata):
+        self.generator = generator
+        self.path = path
+        self.content = content
+        self.mtime = mtime
+        self.metadata = metadata
+
+    def change_extension(self, extension):
+        i = self.path[-1].rfind('.')
+        basename = self.path[-1][0:i]
+        self.path[-1] = basename + extension
+
+
+class OldTemplated(OldFile):
+    def __init__(self, generator, **kwargs):
+        template_name = kwargs.pop('template', None)
+        OldFile.__init__(self, generator, **kwargs)
+        self.change_extension('.html')
+        self.template = generator.templates.get_template(template_name)
+
+
+class OldBlog(OldTemplated):
+    def __init__(self, **kwargs):
+        self.title = kwargs.pop('title')
+        self.published = kwargs.pop('published', None)
+        if self.published is not None:
+            day, month, year = [int(i) for i in self.published.split('/')]
+            self.published = datetime.date(year, month, day)
+        OldTemplated.__init__(self, **kwargs)
+
+
+class Templates(object):
+    '''Stands in for the template lookup, handing out one template.'''
+    template = object()
+
+    def get_template(self, name):
+        return self.template
+
+
+class Generator(object):
+    templates = Templates()
+
+    def cached_content(self, source):
+        return ''
+
+
+def pages(count, content_size=2048):
+    '''The arguments parse_page would build count pages with.'''
+    for i in range(count):
+        # Fresh strings for each page, as the scanner and parser make them
+        path = ['blog', str(2000 + i % 20), 'month-%d' % (i % 12),
+                'post-%d.md' % i]
+        metadata = {
+            'title': 'Post number %d' % i,
+            'published': '%d/%d/%d' % (i % 28 + 1, i % 12 + 1, 2000 + i % 20),
+            'template': 'post.mako',
+            'mtime': datetime.datetime(2020, 1, 1),
+            'extension': '.md',
+        }
+        content = ('<p>%d</p>' % i).ljust(content_size)
+        yield path, metadata, content
+
+
+def old_model(count):
+    generator = Generator()
+    result = []
+    for path, metadata, content in pages(count):
+        result.append(OldBlog(generator=generator, path=path,
+                              content=content, **metadata))
+    return result
+
+
+def new_model(count):
+    generator = Generator()
+    result = []
+    for path, metadata, content in pages(count):
+        new_page = page.Blog(generator=generator, path=path,
+                             content=content, **metadata)
+        new_page.source = '/'.join(path)
+        new_page.loader = functools.partial(generator.cached_content,
+                                            new_page.source)
+        new_page.release()
+        result.append(new_page)
+    return result
+
+
+def measure(func, count):
+    gc.collect()
+    tracemalloc.start()
+    result = func(count)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main(argv):
+    counts = [int(a) for a in argv] or [10000, 100000]
+    for count in counts:
+        old = measure(old_model, count)
+        new = measure(new_model, count)
+        print('%8d pages  old %8.1f MB %6d B/page   new %8.1f MB %6d B/page'
+              '   %.1fx' % (count, old / 2**20, old // count,
+                            new / 2**20, new // count, old / new))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,70 @@
+'''Benchmark pagepress.scanner.scan against the original list_files.
+
+    python bench/scan.py [files] [files per directory]
+
+Builds a synthetic tree in a temporary directory (100,000 files by
+default) and times a full scan with each implementation.
+'''
+import os, sys, time, shutil, tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from pagepress.scanner import scan
+
+
+def listdir_walk(base, path=[]):
+    '''list_files as it was before the scanner: os.listdir, and three
+    stats per file (isdir, isfile, getmtime).'''
+    base_path = os.path.join(base, *path)
+    for entry in os.listdir(base_path):
+        full_path = os.path.join(base_path, entry)
+        if os.path.isdir(full_path) and entry[0:1] != '.':
+            sub_path = path[:]
+            sub_path.append(entry)
+            for s in listdir_walk(base, sub_path):
+                yield s
+        elif os.path.isfile(full_path):
+            file_path = path[:]
+            file_path.append(entry)
+            yield {
+                'path': file_path,
+                'mtime': datetime.fromtimestamp(os.path.getmtime(full_path)),
+                'extension': os.path.splitext(full_path)[1],
+            }
+
+
+def build_tree(base, files, per_directory):
+    for i in range(files):
+        directory = os.path.join(base, 'd%d' % (i // per_directory % 10),
+                                 'd%d' % (i // per_directory))
+        if i % per_directory == 0:
+            os.makedirs(directory)
+        open(os.path.join(directory, 'f%d.md' % i), 'w').close()
+
+
+def timed(name, func, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for f in func())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('%-12s %8d files %8.3fs' % (name, count, best))
+    return best
+
+
+def main(argv):
+    files = int(argv[0]) if argv else 100000
+    per_directory = int(argv[1]) if len(argv) > 1 else 100
+    base = tempfile.mkdtemp(prefix='pagepress-scan-')
+    try:
+        build_tree(base, files, per_directory)
+        old = timed('list_files', lambda: listdir_walk(base))
+        new = timed('scan', lambda: scan(base))
+        print('speedup      %.1fx' % (old / new))
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
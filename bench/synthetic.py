@@ -0,0 +1,152 @@
+'''Build synthetic PagePress sources for benchmarking.
+
+    python bench/synthetic.py directory [pages]
+
+Writes a site with a source directory holding Markdown pages spread over
+nested directories, a chain of Mako templates they inherit from, and
+image assets the pages reference. Everything about its size and shape is
+a parameter of Site, and the same parameters always give the same files.
+'''
+import os, sys, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+PARAGRAPH = '''Some *emphasised* text about %(topic)s, with a [link](/) and
+`code`, and **strong** words to give the parser something to do.
+
+* one
+* two %(n)d
+'''
+
+BASE = '''<!DOCTYPE html>
+<html><head><title>${page.metadata.get('title', '')}</title></head>
+<body>
+<nav>
+%% for i in range(%(loops)d):
+<a href="/section${i}/">Section ${i}</a>
+%% endfor
+</nav>
+${self.body()}
+</body></html>
+'''
+
+LAYOUT = '''<%%inherit file="%(parent)s"/>
+<%%def name="block%(level)d(text)"><div class="l%(level)d">${text}</div></%%def>
+${block%(level)d(capture(next.body))}
+'''
+
+PAGE = '''<%%inherit file="%(parent)s"/>
+<article>${page.content}</article>
+'''
+
+
+class Site(object):
+    '''The parameters of a synthetic site.
+
+    pages       Markdown pages
+    depth       directories deep the pages are spread
+    fanout      subdirectories per directory
+    templates   templates in the inheritance chain of every page
+    loops       iterations of the loop in the base template
+    paragraphs  paragraphs of Markdown per page
+    assets      images, each referenced by one page
+    '''
+    def __init__(self, pages=1000, depth=2, fanout=8, templates=3,
+                 loops=20, paragraphs=10, assets=100, seed=1):
+        self.pages = pages
+        self.depth = depth
+        self.fanout = fanout
+        self.templates = max(1, templates)
+        self.loops = loops
+        self.paragraphs = paragraphs
+        self.assets = assets
+        self.seed = seed
+
+    def parameters(self):
+        return dict(self.__dict__)
+
+    def directory(self, i):
+        parts = []
+        for level in range(self.depth):
+            i, rest = divmod(i, self.fanout)
+            parts.append('d%d' % rest)
+        return parts
+
+    def page_path(self, i):
+        return self.directory(i) + ['page%d.md' % i]
+
+    def page_template(self):
+        '''The template every page is rendered with.'''
+        return 'page.mako'
+
+    def write(self, base):
+        '''Write the source tree beneath base/source.'''
+        source = os.path.join(base, 'source')
+        random.seed(self.seed)
+        self.write_templates(source)
+        for i in range(self.assets):
+            path = os.path.join(source, 'images', 'img%d.png' % i)
+            write(path, bytes(random.getrandbits(8) for b in range(2048)))
+        for i in range(self.pages):
+            write(os.path.join(source, *self.page_path(i)),
+                  self.page_text(i).encode('utf8'))
+
+    def write_templates(self, source):
+        write(os.path.join(source, 'base.mako'),
+              (BASE % {'loops': self.loops}).encode('utf8'))
+        parent = '/base.mako'
+        for level in range(1, self.templates):
+            name = 'layout%d.mako' % level
+            write(os.path.join(source, name),
+                  (LAYOUT % {'parent': parent, 'level': level}).encode('utf8'))
+            parent = '/' + name
+        write(os.path.join(source, self.page_template()),
+              (PAGE % {'parent': parent}).encode('utf8'))
+
+    def page_text(self, i):
+        lines = ['template: /%s' % self.page_template(),
+                 'title: Page %d' % i, '', '# Page %d' % i, '']
+        for p in range(self.paragraphs):
+            lines.append(PARAGRAPH % {'topic': 'topic %d' % (i % 97),
+                                      'n': p})
+        if self.assets and i < self.assets:
+            # Referenced images are registered as static resources
+            lines.append('![Image %d][img%d]' % (i, i))
+            lines.append('')
+            lines.append('[img%d]: /images/img%d.png' % (i, i))
+        return '\n'.join(lines) + '\n'
+
+    def edit_page(self, base, i=0):
+        '''Change the content of one page.'''
+        path = os.path.join(base, 'source', *self.page_path(i))
+        with open(path, 'a') as fp:
+            fp.write('\nAn edit.\n')
+        bump(path)
+
+    def edit_template(self, base):
+        '''Change the template every page is rendered with.'''
+        path = os.path.join(base, 'source', self.page_template())
+        with open(path, 'a') as fp:
+            fp.write('<!-- an edit -->\n')
+        bump(path)
+
+
+def write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+
+def bump(path, seconds=2):
+    '''Move an edited file's mtime forward, as Mako only notices changes
+    to templates at a whole second's resolution.'''
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime + seconds, stat.st_mtime + seconds))
+
+
+if __name__ == '__main__':
+    Site(pages=int(sys.argv[2]) if len(sys.argv) > 2 else 1000).write(
+        sys.argv[1])
@@ -0,0 +1,53 @@
+import os, pickle, hashlib, logging
+
+log = logging.getLogger(__name__)
+
+
+class ParseCache(object):
+    '''Parser output kept on disk between builds.
+
+    Each source file gets one pickle in the directory, holding the hash
+    of the content it was parsed from, the parser and its version, and
+    what the parser returned (pagetype, metadata and content) along with
+    any static resources registered while parsing. An entry is only used
+    if all of those still match, and is overwritten when they don't, so
+    the cache never holds more than one entry per source.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    def filename(self, source):
+        name = hashlib.sha1(source.encode('utf8')).hexdigest()
+        return os.path.join(self.directory, name[:2], name + '.pickle')
+
+    def signature(self, parser):
+        return '%s.%s:%s' % (parser.__class__.__module__,
+                             parser.__class__.__name__, parser.version)
+
+    def get(self, source, digest, parser):
+        '''Return (pagetype, metadata, content, static) for source, or None
+        if it was not cached for this content and parser.'''
+        try:
+            with open(self.filename(source), 'rb') as fp:
+                entry = pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug('Ignoring unreadable parse cache for %s (%s)' %
+                      (source, e))
+            return None
+        if entry[0] != digest or entry[1] != self.signature(parser):
+            return None
+        return entry[2]
+
+    def put(self, source, digest, parser, parsed):
+        filename = self.filename(source)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        # Workers may write the same entry at once, so write then rename
+        temp = '%s.%d.tmp' % (filename, os.getpid())
+        with open(temp, 'wb') as fp:
+            pickle.dump((digest, self.signature(parser), parsed), fp,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, filename)
@@ -0,0 +1,287 @@
+import re, json, hashlib, logging, datetime
+from mako.exceptions import TopLevelLookupException
+
+log = logging.getLogger(__name__)
+
+
+class Post(object):
+    '''A Blog page as it appears in the index.
+
+    Only the metadata is held; content is loaded from the parse cache the
+    first time a template asks for it.
+    '''
+    __slots__ = ('generator', 'source', 'url', 'title', 'published', 'tags',
+                 'hash', '_content')
+
+    def __init__(self, generator, source, record, digest):
+        self.generator = generator
+        self.source = source
+        self.url = record['url']
+        self.title = record['title']
+        self.published = record['published']
+        if self.published is not None:
+            self.published = datetime.date(*[int(i) for i in
+                                             self.published.split('-')])
+        self.tags = record['tags']
+        self.hash = digest
+        self._content = None
+
+    @property
+    def date(self):
+        return self.published
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.generator.page_content(self.source)
+        return self._content
+
+    def signature(self):
+        return [self.url, self.title, str(self.published), self.tags,
+                self.hash]
+
+
+class Paginator(object):
+    '''One page of a listing, in the shape the Jekyll style layouts use.'''
+    def __init__(self, posts, page, per_page, total_posts, base):
+        self.posts = posts
+        self.page = page
+        self.per_page = per_page
+        self.total_posts = total_posts
+        self.total_pages = max(1, -(-total_posts // per_page))
+        self.base = base
+        self.previous_page = page - 1 if page > 1 else None
+        self.next_page = page + 1 if page < self.total_pages else None
+
+    def page_url(self, page):
+        if page is None:
+            return None
+        if page == 1:
+            return self.base
+        return '%spage%d/' % (self.base, page)
+
+    @property
+    def previous_page_path(self):
+        return self.page_url(self.previous_page)
+
+    @property
+    def next_page_path(self):
+        return self.page_url(self.next_page)
+
+
+class View(object):
+    '''A generated page listing posts: an index page, an archive page or
+    a feed. It is rendered like a Templated page.'''
+    def __init__(self, generator, output, template, posts, **context):
+        self.generator = generator
+        self.path = output.split('/')
+        self.template_name = template
+        self.posts = posts
+        self.context = context
+        self.metadata = {}
+        self.title = context.get('title')
+
+    def url(self):
+        url = '/' + '/'.join(self.path)
+        if url.endswith('/index.html'):
+            url = url[:-len('index.html')]
+        return url
+
+    def signature(self):
+        '''Everything which affects the rendered view, hashed.'''
+        paginator = self.context.get('paginator')
+        data = [self.template_name, self.url(), self.title,
+                [post.signature() for post in self.posts]]
+        if paginator is not None:
+            data.append([paginator.page, paginator.total_pages,
+                         paginator.total_posts])
+        for name in ('tag', 'month'):
+            data.append(str(self.context.get(name)))
+        return hashlib.sha1(json.dumps(data).encode('utf8')).hexdigest()
+
+    def render(self, **kwargs):
+        template = self.generator.templates.get_template(self.template_name)
+        return template.render_unicode(pagepress=self.generator, page=self,
+                                       posts=self.posts, **self.context)
+
+
+def slugify(value):
+    return re.sub(r'[^a-z0-9]+', '-', value.lower()).strip('-')
+
+
+class Collections(object):
+    '''Index, archive and feed pages built over all Blog pages.
+
+    Every Blog page leaves a small record in the build manifest. From these
+    a single index, sorted newest first, is built, and every listing is a
+    slice of it (or of the per tag and per month lists taken from it in
+    one pass):
+
+    * the paginated index, /index.html, /page2/index.html, ...
+    * paginated archives for each tag, /tags/<tag>/, and each month,
+      /archive/<year>/<month>/
+    * atom feeds of the latest posts, /atom.xml and /tags/<tag>/atom.xml
+
+    Each kind is only generated if its template exists, and a listing is
+    not generated where a page in the source writes the same file. Every
+    view is signed with a hash of the posts it shows, and only views whose
+    signature (or templates) changed are rendered again, so editing one
+    post only renders the listings which include it.
+    '''
+    def __init__(self, generator, config):
+        self.generator = generator
+        self.per_page = int(config.get('paginate') or 10)
+        self.feed_size = int(config.get('feed_size') or 20)
+        self.index_template = config.get('index_template') or 'index.mako'
+        self.archive_template = config.get('archive_template') or \
+            'archive.mako'
+        self.feed_template = config.get('feed_template') or 'atom.mako'
+
+    def has_template(self, name):
+        try:
+            self.generator.templates.get_template(name)
+        except TopLevelLookupException:
+            return False
+        return True
+
+    def index(self):
+        '''All the posts, newest first.'''
+        posts = []
+        for source, record in self.generator.manifest.sources.items():
+            if record.get('post') and record.get('built', True):
+                posts.append(Post(self.generator, source, record['post'],
+                                  record['hash']))
+        posts.sort(key=lambda p: (p.published is not None,
+                                  p.published or datetime.date.min, p.url),
+                   reverse=True)
+        return posts
+
+    def paginate(self, posts, base, template, **context):
+        '''Views for each page of posts, under the base url.'''
+        total = len(posts)
+        pages = max(1, -(-total // self.per_page))
+        for page in range(1, pages + 1):
+            start = (page - 1) * self.per_page
+            paginator = Paginator(posts[start:start + self.per_page], page,
+                                  self.per_page, total, base)
+            if page == 1:
+                output = base[1:] + 'index.html'
+            else:
+                output = '%spage%d/index.html' % (base[1:], page)
+            yield View(self.generator, output, template, paginator.posts,
+                       paginator=paginator, **context)
+
+    def views(self, posts):
+        if self.has_template(self.index_template):
+            for view in self.paginate(posts, '/', self.index_template):
+                yield view
+        feeds = self.has_template(self.feed_template)
+        if feeds:
+            yield View(self.generator, 'atom.xml', self.feed_template,
+                       posts[:self.feed_size])
+
+        if not self.has_template(self.archive_template):
+            if feeds:
+                for tag, tagged in self.by_tag(posts):
+                    yield View(self.generator,
+                               'tags/%s/atom.xml' % slugify(tag),
+                               self.feed_template, tagged[:self.feed_size],
+                               tag=tag)
+            return
+        for tag, tagged in self.by_tag(posts):
+            base = '/tags/%s/' % slugify(tag)
+            for view in self.paginate(tagged, base, self.archive_template,
+                                      tag=tag, title=tag):
+                yield view
+            if feeds:
+                yield View(self.generator, base[1:] + 'atom.xml',
+                           self.feed_template, tagged[:self.feed_size],
+                           tag=tag)
+        for month, dated in self.by_month(posts):
+            base = '/archive/%04d/%02d/' % (month.year, month.month)
+            for view in self.paginate(dated, base, self.archive_template,
+                                      month=month,
+                                      title=month.strftime('%B %Y')):
+                yield view
+
+    def by_tag(self, posts):
+        tags = {}
+        for post in posts:
+            for tag in post.tags:
+                tags.setdefault(tag, []).append(post)
+        return sorted(tags.items())
+
+    def by_month(self, posts):
+        months = {}
+        for post in posts:
+            if post.published is not None:
+                month = post.published.replace(day=1)
+                months.setdefault(month, []).append(post)
+        return sorted(months.items(), reverse=True)
+
+    def update(self, changed):
+        '''Render the views which have changed. changed is the set of
+        source paths changed in this build, for spotting template edits.
+
+        The static resources a view registers are recorded with it, and
+        tracked against its output path from the root ('/' + output, which
+        no source path looks like). Returns those paths for the views
+        rendered, so their resources can be synced.'''
+        generator = self.generator
+        manifest = generator.manifest
+        previous = manifest.views
+        current = {}
+        rendered = []
+        # A page in the source wins over a listing written to the same
+        # place, so a site can have an index.html of its own
+        sources = set()
+        for record in manifest.sources.values():
+            sources.update(record.get('outputs', ()))
+        for view in self.views(self.index()):
+            output = '/'.join(view.path)
+            if output in current:
+                log.warning('Two listings write to %s' % output)
+                continue
+            if output in sources:
+                log.warning('A source page writes to %s, so the listing '
+                            'is not generated' % output)
+                continue
+            signature = view.signature()
+            record = previous.get(output, {})
+            if record.get('signature') == signature and \
+                    not changed.intersection(record.get('templates', ())):
+                current[output] = record
+                continue
+            key = '/' + output
+            # Relative static resources resolve against the view's directory
+            current_path = generator.current_path
+            generator.current_path = view.path[:-1]
+            generator.track(key)
+            try:
+                log.debug('Generating listing %s' % output)
+                outputs = generator.output_content(
+                    output, view.render().encode('utf8'),
+                    record.get('outputs', {}))
+            except Exception as e:
+                log.error('Error rendering listing %s (%s)' % (output, e))
+                if generator.stop_on_error:
+                    raise
+                continue
+            finally:
+                templates = generator.template_dependencies(key)
+                generator.track(None)
+                generator.current_path = current_path
+            current[output] = {'signature': signature,
+                               'templates': templates,
+                               'static': generator.static_resources.paths(key),
+                               'outputs': outputs}
+            rendered.append(key)
+        kept = set(sources)
+        for record in current.values():
+            kept.update(record['outputs'])
+        for output, record in previous.items():
+            if output not in current:
+                generator.remove_outputs(
+                    [o for o in record.get('outputs', {}) if o not in kept])
+        manifest.views = current
+        return rendered
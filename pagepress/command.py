@@ -1,9 +1,9 @@
-import sys, os, logging, posixpath, urllib, textwrap
+import sys, logging, textwrap
 from logging.config import fileConfig
 from argparse import ArgumentParser
 from configparser import SafeConfigParser
 from pagepress.generator import Generator
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from pagepress.server import serve
 
 log = logging.getLogger(__name__)
 
@@ -27,50 +27,6 @@ def asbool(value):
     return value in truthy
 
 
-'''Simple Handler for PagePress to attempt to resolve a URL
-and serve it via a built in browser.
-
-This is not particularly configurable and should not be used
-for anything but testing
-'''
-class PagepressHTTPHandler(SimpleHTTPRequestHandler):
-    def do_GET(self, *args, **kwargs):
-        self.generator.update()
-        return SimpleHTTPRequestHandler.do_GET(self, *args, **kwargs)
-
-    def translate_path(self, path):
-        '''Translate a /-separated PATH to the local filename syntax.
-
-        Ripped off from SimpleHTTPRequestHandler
-
-        '''
-        # abandon query parameters
-        path = path.split('?',1)[0]
-        path = path.split('#',1)[0]
-        path = posixpath.normpath(urllib.unquote(path))
-        words = path.split('/')
-        words = filter(None, words)
-        path = os.path.join(self.generator.base, 'static')
-        for word in words:
-            drive, word = os.path.splitdrive(word)
-            head, word = os.path.split(word)
-            if word in (os.curdir, os.pardir): continue
-            path = os.path.join(path, word)
-        return path
-    
-
-'''Utility function to serve a PagePress setup using the above HTTP Handler'''
-def serve(generator):
-    server_address = ('', 6554)
-
-    PagepressHTTPHandler.generator = generator
-    httpd = HTTPServer(server_address, PagepressHTTPHandler)
-
-    sa = httpd.socket.getsockname()
-    log.info("Serving HTTP on %s:%s" % (sa[0], sa[1]))
-    httpd.serve_forever()
-
-
 '''Process the PagePress CLI arguments and merge them with
 a config file (is one is given).
 '''
@@ -86,7 +42,8 @@ def process_argv(argv, config):
     parser = ArgumentParser(
         prog='pagepress',
         description=textwrap.dedent(usage),
-        usage='pagepress [options] [generate or serve]',
+        usage='pagepress [options] [generate, serve, status, merge or ' \
+              'compile-templates]',
         )
     parser.add_argument(
         '-d', '--debug',
@@ -113,11 +70,131 @@ def process_argv(argv, config):
         default=config.pop('output', 'html'),
         help="The output directory.",
         )
+    parser.add_argument(
+        '--jobs', '-j',
+        action='store',
+        type=int,
+        default=config.pop('jobs', 1),
+        help="The number of processes to parse and render pages with.",
+        )
+    parser.add_argument(
+        '--watch',
+        action='store',
+        choices=['auto', 'inotify', 'poll', 'none'],
+        default=config.pop('watch', 'auto'),
+        help="How serve notices changes to the source. 'none' checks the " \
+             "whole source on every request.",
+        )
+    parser.add_argument(
+        '--no-livereload',
+        action='store_false',
+        dest='livereload',
+        default=config.pop('livereload', True),
+        help="Don't reload pages in the browser when they change.",
+        )
+    parser.add_argument(
+        '--memory-cache',
+        action='store',
+        type=float,
+        default=config.pop('memory_cache', 64),
+        help="Megabytes of rendered output serve keeps in memory.",
+        )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        default=config.pop('stream', False),
+        help="Write every page to disk in chunks as it renders, to keep " \
+             "memory use down for very large pages.",
+        )
+    parser.add_argument(
+        '--static-method',
+        action='store',
+        choices=['copy', 'reflink', 'hardlink'],
+        default=config.pop('static_method', 'copy'),
+        help="How static resources are put in the output. reflink and " \
+             "hardlink fall back to copying where they aren't supported.",
+        )
+    parser.add_argument(
+        '--staged',
+        action='store_true',
+        default=config.pop('staged', False),
+        help="Write the build beside the output directory, and move it " \
+             "into place file by file when it is complete, so the output " \
+             "is never left half updated.",
+        )
+    parser.add_argument(
+        '--low-memory',
+        action='store_true',
+        default=config.pop('low_memory', False),
+        help="Parse, render and write pages one at a time, rather than " \
+             "parsing them all first, so memory use stays flat however " \
+             "big the site is.",
+        )
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        default=config.pop('quick', False),
+        help="For status, and before generate, only check whether any " \
+             "directory in the source changed since the last build. Files " \
+             "edited in place, rather than saved by renaming over the " \
+             "old one as most editors do, are missed.",
+        )
+    parser.add_argument(
+        '--shard',
+        action='store',
+        metavar='i/N',
+        default=config.pop('shard', None),
+        help="Build only the pages in shard i of N (numbered from 1), " \
+             "chosen by a hash of their path, into an output directory " \
+             "of the shard's own. Combine the shards with merge.",
+        )
+    parser.add_argument(
+        '--shards',
+        action='store',
+        type=int,
+        metavar='N',
+        default=config.pop('shards', None),
+        help="The number of shards for merge to combine.",
+        )
+    parser.add_argument(
+        '--profile',
+        action='store',
+        type=int,
+        metavar='N',
+        default=config.pop('profile', None),
+        help="After generating, list the time spent in each phase and the " \
+             "N slowest pages and templates.",
+        )
+    parser.add_argument(
+        '--report',
+        action='store',
+        metavar='FILE',
+        default=config.pop('report', None),
+        help="Write a JSON report of where the build's time went to FILE.",
+        )
+    parser.add_argument(
+        '--cprofile',
+        action='store',
+        metavar='FILE',
+        default=config.pop('cprofile', None),
+        help="Run the page generation under cProfile, saving the stats " \
+             "to FILE (only pages generated in this process are seen).",
+        )
+    parser.add_argument(
+        '--tracemalloc',
+        action='store',
+        type=int,
+        metavar='N',
+        default=config.pop('tracemalloc', 0),
+        help="Trace memory during page generation, and add the N " \
+             "biggest allocation sites to the report.",
+        )
     parser.add_argument(
         'command',
         nargs=1,
         action='store',
-        choices=['generate', 'serve'],
+        choices=['generate', 'serve', 'status', 'merge',
+                 'compile-templates'],
         help='The command you wish to run.',
     )
     config.update(vars(parser.parse_args(argv)))
@@ -133,8 +210,9 @@ def command(argv=sys.argv[1:]):
         'pagepress/config.ini',
     ]
     bools = ['colour', 'dryrun', 'fail_fast', 
-             'no_logs', 'no_stdout', 'backtrace']
-    lists = ['locations']
+             'no_logs', 'no_stdout', 'backtrace', 'livereload', 'stream',
+             'low_memory', 'quick', 'staged', 'warm_templates']
+    lists = ['locations', 'ignore', 'compress_types']
     config = {}
 
     file_parser = SafeConfigParser()
@@ -167,8 +245,35 @@ def command(argv=sys.argv[1:]):
     g = Generator(config)
  
     if 'generate'in config['command']:
-        g.update()
+        if config['quick'] and not g.status(quick=True):
+            log.info('Nothing has changed since the last build')
+            return
+        result = g.update()
+        if config['profile']:
+            for line in result.timings.summary(config['profile']):
+                print(line)
+    elif 'merge' in config['command']:
+        if not config['shards']:
+            log.error('merge needs to be told how many --shards there are')
+            sys.exit(2)
+        g.merge(config['shards'])
+    elif 'status' in config['command']:
+        # Exits 1 if a rebuild is needed, for use from cron or CI
+        reasons = g.status(quick=config['quick'])
+        for reason in reasons:
+            log.info(reason)
+        if reasons:
+            sys.exit(1)
+        log.info('Up to date')
+    elif 'compile-templates' in config['command']:
+        results = g.compile_templates()
+        for uri, seconds, error in results:
+            log.info('%8.1fms %s%s' % (seconds * 1000, uri,
+                                       ' FAILED' if error else ''))
+        if any(error for uri, seconds, error in results):
+            sys.exit(1)
     else:
-        serve(g)
+        serve(g, watch=config['watch'], livereload=config['livereload'],
+              memory_cache=config['memory_cache'])
 
 
@@ -0,0 +1,215 @@
+import logging, os, time, zlib, mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+
+# Types worth precompressing. Images, fonts and archives are already
+# compressed and only get bigger.
+DEFAULT_TYPES = (
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/xml',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'application/atom+xml',
+    'application/rss+xml',
+    'image/svg+xml',
+)
+
+
+class Codec(object):
+    name = None
+    extension = None
+    default_level = None
+
+    def __init__(self, level=None):
+        self.level = self.default_level if level is None else level
+
+    def available(self):
+        return True
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def stream(self):
+        '''A compressor for data arriving in chunks, with compress(data)
+        and flush() methods like zlib's.'''
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '%s:%s' % (self.name, self.level)
+
+
+class Gzip(Codec):
+    '''Gzip via zlib.
+
+    zlib writes the gzip header with a zero mtime and no filename, so the
+    output only depends on the input and the level.
+    '''
+    name = 'gzip'
+    extension = '.gz'
+    default_level = 9
+
+    def stream(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        c = self.stream()
+        return c.compress(data) + c.flush()
+
+
+class Brotli(Codec):
+    name = 'br'
+    extension = '.br'
+    default_level = 11
+
+    def available(self):
+        return brotli is not None
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def stream(self):
+        return BrotliStream(brotli.Compressor(quality=self.level))
+
+
+class BrotliStream(object):
+    def __init__(self, compressor):
+        self.compressor = compressor
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+class Zstd(Codec):
+    name = 'zstd'
+    extension = '.zst'
+    default_level = 19
+
+    def available(self):
+        return zstandard is not None
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+
+codecs = {
+    'gzip': Gzip,
+    'gz': Gzip,
+    'br': Brotli,
+    'brotli': Brotli,
+    'zstd': Zstd,
+    'zst': Zstd,
+}
+
+
+def parse_codecs(spec):
+    '''Turn a config value like "gzip:9 br:11 zstd" into Codec instances.
+
+    Codecs whose library is not installed are skipped with a warning.
+    '''
+    if isinstance(spec, str):
+        spec = spec.replace(',', ' ').split()
+    result = []
+    for item in spec:
+        name, _, level = item.partition(':')
+        codec = codecs[name.strip().lower()](int(level) if level else None)
+        if not codec.available():
+            log.warning('Compression with %s is not available, install '
+                        'the library to enable it' % codec.name)
+            continue
+        result.append(codec)
+    return result
+
+
+class Compressor(object):
+    '''Writes precompressed siblings of output files in a thread pool.
+
+    Both zlib and the brotli/zstd bindings release the GIL, so compressing
+    in threads overlaps with the rendering of the next page. Files are
+    only compressed if their type is in the allowed types and they are at
+    least min_size bytes.
+    '''
+    def __init__(self, codecs, min_size=0, types=DEFAULT_TYPES, jobs=None):
+        self.codecs = codecs
+        self.min_size = min_size
+        self.types = set(types)
+        self.extensions = set(c.extension for c in codecs)
+        self.jobs = jobs
+        self.executor = None
+        self.pending = []
+        # A pagepress.instrument.Timings to count compression in
+        self.timings = None
+
+    def outputs(self, path, size):
+        '''The codecs which apply to path, given its size.'''
+        if size < self.min_size or not self.codecs:
+            return []
+        if os.path.splitext(path)[1] in self.extensions:
+            return []
+        mimetype = mimetypes.guess_type(path)[0]
+        if mimetype not in self.types:
+            return []
+        return self.codecs
+
+    def siblings(self, path, size):
+        '''The names of the compressed files that will be written for path.'''
+        return [path + codec.extension
+                for codec in self.outputs(path, size)]
+
+    def submit(self, filename, data=None):
+        '''Queue compression of filename (or data if given, which should
+        be the contents of filename) into each applicable codec.'''
+        if data is None:
+            size = os.path.getsize(filename)
+        else:
+            size = len(data)
+        for codec in self.outputs(filename, size):
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+            self.pending.append(self.executor.submit(
+                self.compress, codec, filename, data))
+
+    def compress(self, codec, filename, data=None):
+        start = time.perf_counter()
+        if data is None:
+            with open(filename, 'rb') as fp:
+                data = fp.read()
+        compressed = codec.compress(data)
+        with open(filename + codec.extension, 'wb') as fp:
+            fp.write(compressed)
+        if self.timings is not None:
+            self.timings.add('compress', time.perf_counter() - start,
+                             size=len(compressed))
+
+    def wait(self):
+        '''Wait for all queued compression, raising the first error.'''
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
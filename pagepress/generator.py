@@ -1,41 +1,108 @@
-import logging, os, errno, gzip, shutil, codecs
+import logging, os, time, errno, shutil, hashlib, functools, traceback
+from concurrent.futures import ( ProcessPoolExecutor, as_completed, wait,
+                                 FIRST_COMPLETED, ALL_COMPLETED)
 from datetime import datetime
 from pagepress.page import ( File, Page, Blog, HTML, Templated, Stylesheet,
                             Javascript)
 from pagepress.parsers import Markdown, CSS, JS
-from mako.lookup import TemplateLookup
+from pagepress.manifest import Manifest, file_hash
+from pagepress.cache import ParseCache
+from pagepress.stream import StreamWriter
+from pagepress.compress import Compressor, DEFAULT_TYPES, parse_codecs
+from pagepress.scanner import scan, stat_entry, DirectorySnapshot
+from pagepress.templates import TrackingLookup, compile_templates
+from pagepress.instrument import Timings, capture, save_report
+from pagepress.shard import ( parse_shard, shard_of, shard_output,
+                             shard_data, files)
+from pagepress.collection import Collections
+from pagepress.static import StaticSync, StaticRegistry
 
 log = logging.getLogger(__name__)
 
 
 def list_files(base, path=[]):
-    '''This function can be made much quicker
-    by performing a lstat on each loop, and interpeting 
-    all of the results. 
+    '''Yield a dict describing each file beneath base.
 
-    In the Current Version, each file gets stat'd three times. (dirs only once
-    though)
+    Kept for compatibility, the Generator itself works with the compact
+    Entry records from pagepress.scanner.scan, which this wraps.
     '''
-    base_path = os.path.join(base, *path)
-    for entry in os.listdir(base_path):
-        full_path = os.path.join(base_path, entry)
-        if os.path.isdir(full_path) and entry[0:1] != '.':
-            sub_path = path[:] 
-            sub_path.append(entry)
-            for s in list_files(base, sub_path):
-                yield s
-        elif os.path.isfile(full_path):
-            file_path = path[:]
-            file_path.append(entry)
-            yield {
-                'path': file_path,
-                'mtime': datetime.fromtimestamp(os.path.getmtime(full_path)),
-                'extension': os.path.splitext(full_path)[1],
-            }
+    for entry in scan(os.path.join(base, *path)):
+        yield {
+            'path': list(path) + list(entry.path),
+            'mtime': datetime.fromtimestamp(entry.mtime),
+            'size': entry.size,
+            'extension': entry.extension,
+        }
+
+
+# The Generator each worker process builds pages with
+_worker = None
+
+def _init_worker(config):
+    global _worker
+    _worker = Generator(config)
+
+def _build_page(page, previous):
+    try:
+        return _build_worker_page(page, previous)
+    except Exception as e:
+        # Mako's exceptions can't be unpickled in the parent process, so
+        # raise one which can, with the worker's traceback in it
+        raise RuntimeError('Could not build %s (%s)\n%s' %
+                           (page.key, e, traceback.format_exc()))
+
+def _build_worker_page(page, previous):
+    _worker.reset_result()
+    _worker.static_resources = StaticRegistry()
+    page = _worker.parse_page(page)
+    if page is None:
+        return None
+    _worker.render_page(page, previous)
+    _worker.track(None)
+    _worker.compressor.wait()
+    if page.source not in _worker.built:
+        return None
+    return (page.source, _worker.built.pop(page.source), _worker.result,
+            _worker.static_resources)
+
+
+class BuildResult(object):
+    '''What a build did to the output directory.
+
+    Each list holds output paths relative to the output directory.
+    Outputs whose rendered content was identical to the last build are
+    skipped rather than written. timings holds where the time went, see
+    pagepress.instrument.
+    '''
+    def __init__(self):
+        self.written = []
+        self.skipped = []
+        self.deleted = []
+        self.timings = Timings()
+        self.seconds = None
+        self.profile = {}
+
+    def merge(self, other):
+        self.written.extend(other.written)
+        self.skipped.extend(other.skipped)
+        self.deleted.extend(other.deleted)
+        self.timings.merge(other.timings)
+
+    def report(self, count=10):
+        '''The build report, a dict ready to be dumped as JSON, listing
+        the count slowest pages and templates.'''
+        report = self.timings.report(self, self.seconds, count)
+        report.update(self.profile)
+        return report
+
+    def __str__(self):
+        return '%d written, %d skipped, %d deleted' % (
+            len(self.written), len(self.skipped), len(self.deleted))
 
 
 class Generator:
     def __init__(self, config):
+        self.config = config
         self.base = config.get('pagepress:main', 'base')
         self.source = os.path.join(self.base, 
             config.get('pagepress:main', 'source'))
@@ -43,12 +110,40 @@ class Generator:
         	config.get('pagepress:main', 'static'))
         self.data = os.path.join(self.base,
         	config.get('pagepress:main', 'data'))
+        # Where the manifest and snapshot are kept
+        self.state = self.data
+        # A shard builds the pages whose path hashes to it, into its own
+        # output directory with its own manifest, see merge
+        self.shard = parse_shard(config.get('shard'))
+        if self.shard is not None:
+            self.merged_path = self.web_path
+            self.web_path = shard_output(self.web_path, *self.shard)
+            self.state = shard_data(self.data, *self.shard)
 
-        self.static_resources = []
+        self.static_resources = StaticRegistry()
+        self.parsed = []
+        self.warned_pages = False
         self.current_path = []
+        self.current_source = None
+        self.page_templates = {}
+        self.built = {}
+        self.result = BuildResult()
+        self.manifest = None
+        self.parse_cache = ParseCache(os.path.join(self.data, 'parsed'))
+        self.snapshot = DirectorySnapshot(
+            os.path.join(self.state, 'snapshot.json'))
+        # In staged mode outputs are written to a stage beside the output
+        # directory (so on the same filesystem) and published at the end,
+        # see publish. output_path is where outputs are written.
+        self.staged = config.get('staged') or False
+        self.stage_path = self.web_path.rstrip(os.sep) + '.stage'
+        self.output_path = self.stage_path if self.staged else self.web_path
+        self.deferred = None
+        # An OutputStore to put rendered pages in, see pagepress.store
+        self.store = None
 
         self.parsers = {
-            #'.md': Markdown(self),
+            '.md': Markdown(self),
             '.css': CSS(self),
             '.js': JS(self),
         }
@@ -64,131 +159,872 @@ class Generator:
 
         template_debugging = config.get('pagepress:main', 'template_debugging')
         self.stop_on_error = config.get('pagepress:main', 'stop_on_error')
-        self.templates = TemplateLookup(directories=[os.path.join(self.base, 'source')], 
-                                        input_encoding='utf8',
-                                        output_encoding='utf8',
-                                        module_directory=self.data,
-                                        format_exceptions=template_debugging,
-                                       )
-
-    def update(self):
+        self.jobs = int(config.get('jobs') or 1)
+        self.ignore = config.get('ignore') or ()
+        self.stream = config.get('stream') or False
+        self.stream_chunk = int(config.get('stream_chunk') or 65536)
+        self.low_memory = config.get('low_memory') or False
+        self.compressor = Compressor(
+            parse_codecs(config.get('compress') or 'gzip:9'),
+            min_size=int(config.get('compress_min_size') or 0),
+            types=config.get('compress_types') or DEFAULT_TYPES,
+            jobs=int(config.get('compress_jobs') or 0) or None)
+        self.template_options = dict(directories=[self.source],
+                                     input_encoding='utf8',
+                                     output_encoding='utf8',
+                                     module_directory=self.data,
+                                     format_exceptions=template_debugging,
+                                    )
+        self.templates = TrackingLookup(**self.template_options)
+        self.warm_templates = config.get('warm_templates', True)
+        # Set by update, when the compiled templates may be out of date
+        self.warm = False
+        self.report = config.get('report')
+        self.profile = int(config.get('profile') or 10)
+        self.cprofile = config.get('cprofile')
+        self.tracemalloc = int(config.get('tracemalloc') or 0)
+        self.collections = Collections(self, config)
+        self.static_sync = StaticSync(
+            config.get('static_method') or 'copy',
+            jobs=int(config.get('static_jobs') or 0) or None)
+
+    @property
+    def pages(self):
+        '''Deprecated. The pages parsed by this build in this process,
+        which is only the changed pages, and none at all with more than
+        one job or in low memory mode. Listings of posts are generated by
+        pagepress.collection, whose templates are given every post.'''
+        if not self.warned_pages:
+            self.warned_pages = True
+            log.warning('pagepress.pages is deprecated, and only holds the '
+                        'pages parsed by this build (none with jobs or '
+                        'low_memory). List posts with the index, archive '
+                        'and feed templates instead.')
+        return self.parsed
+
+    def update(self, paths=None):
         '''
-        Firstly we loop through the source, and look for an mtime greater than
-        the last generation. If we find one, then we generate.
+        Firstly we loop through the source, and compare each file against
+        the build manifest. If paths is given (from a watcher) only those
+        source paths are checked, and the source is not walked at all.
+        Only files which are new or whose contents have changed since the
+        last build are generated, along with the outputs of any removed
+        files being deleted.
+
+        Every page records the templates it was rendered with, so a change
+        to a template (or anything it inherits, includes or imports)
+        generates only the pages which used it.
+
+        Returns a BuildResult describing the outputs written, skipped
+        because they were unchanged, and deleted.
+
+        With the low_memory setting pages are built one by one as they are
+        found (see generate_stream) rather than all being parsed first.
 
-        If we are newer, and have to generate, we make a couple of passes
-        1. Generate the Page Object for each file
+        If we have to generate, we make a couple of passes
+        1. Generate the Page Object for each changed file
         2. Let them parse their own contents
         3. Pass them to the templater
         '''
-        generated_file = os.path.join(self.web_path, 'generated.txt')
-        try:
-            fp = open(generated_file, "r")
-            gen_string = fp.readline()
-            fp.close()
-            generated = datetime.strptime(gen_string, '%d/%m/%Y %H:%M:%S')
-        except Exception as e:
-            generated = datetime(1900,1,1)
-
         log.debug('Checking source for updated files')
-        pages = list_files(self.source)
-        # We check the mtimes here, to try and keep the check as 
-        # 'light' as possible
-        generate_time = None
-        newer = False
-        page_defs = []
+        # We check the mtimes and sizes here, to try and keep the check as
+        # 'light' as possible. Files are only hashed when these differ.
+        if self.manifest is None:
+            self.manifest = Manifest(
+                os.path.join(self.state, 'manifest.json')).load()
+        manifest = self.manifest
+        start = time.perf_counter()
+        self.reset_result()
+        timings = self.result.timings
+        if self.staged:
+            # Anything left from a build which didn't finish is discarded;
+            # the manifest was not saved, so it will be built again
+            shutil.rmtree(self.stage_path, ignore_errors=True)
+            self.deferred = []
+        self.static_resources = StaticRegistry()
+        full = not len(manifest)
+        pending = set(manifest.pending())
+        keys = set()
+        # The directory mtimes seen by a full scan, see status
+        directories = {} if paths is None or full else None
+        if full:
+            # Everything is new, so nothing needs to be remembered about the
+            # scan; pages can be built as they are found.
+            changed = self.check(scan(self.source, self.ignore, directories),
+                                 pending, keys)
+            removed = []
+        else:
+            with timings.timer('scan'):
+                changed, removed = self.changes(paths, pending, directories)
+            if not changed and not removed and \
+                    manifest.compressed == sorted(self.compressor.extensions):
+                log.debug('No changes found')
+                self.save_snapshot(directories)
+                return self.result
+            keys.update(page.key for page in changed)
+            for key in keys.union(removed):
+                if os.path.splitext(key)[1] not in self.parsers:
+                    # Perhaps a template, see TrackingLookup.invalidate
+                    self.templates.invalidate(key)
+            for key in manifest.dependents(keys.union(removed)):
+                if key in keys:
+                    continue
+                page = stat_entry(self.source, key, self.ignore)
+                if page is not None:
+                    log.debug('Template change affects %s' % key)
+                    keys.add(key)
+                    changed.append(page)
+
+        # Compiling every template only pays off on a cold build, or when
+        # a template changed; otherwise the modules in data are current
+        self.warm = self.warm_templates and \
+            (full or any(key.endswith('.mako') for key in keys))
+        for key in removed:
+            log.debug('Source removed: %s' % key)
+            self.remove_outputs(manifest.remove(key))
+        with capture(self.cprofile, self.tracemalloc, self.result.profile):
+            if self.low_memory:
+                generate_time = self.generate_stream(changed)
+            else:
+                changed = list(changed)
+                generate_time = self.generate_all(
+                    [page for page in changed
+                     if page.extension in self.parsers])
+                for page in changed:
+                    self.record(page)
+
+        views = []
+        if self.shard is None:
+            # Listings need every post, so shards leave them to merge
+            with timings.timer('collections'):
+                views = self.collections.update(keys.union(removed))
+
+        registry = self.static_resources
+        for source, sr in manifest.static_resources():
+            registry.add(registry.normalize(sr), source)
+        compressed = sorted(self.compressor.extensions)
+        if full or manifest.compressed != compressed:
+            # Unchanged resources may need compressing, see copy_static
+            sync = list(registry)
+        else:
+            # Only resources referenced by the pages built, or which are
+            # themselves among the changed files, can need copying
+            sync = {}
+            for key in keys:
+                for sr in registry.paths(key):
+                    sync[sr] = None
+                if '/' + key in registry:
+                    sync['/' + key] = None
+            for key in views:
+                for sr in registry.paths(key):
+                    sync[sr] = None
+        with timings.timer('static'):
+            self.prune_static(manifest.synced)
+            self.copy_static(sync)
+        manifest.synced = list(registry)
+        manifest.compressed = compressed
+
+        manifest.generated = generate_time.strftime('%d/%m/%Y %H:%M:%S')
+        self.write_output(os.path.join(self.output_path, 'generated.txt'),
+                          manifest.generated.encode('utf8'))
+        if self.staged:
+            with timings.timer('publish'):
+                self.publish()
+        # The manifest goes last, so if anything above fails the next
+        # build does it all again
+        with timings.timer('manifest'):
+            manifest.save()
+        self.save_snapshot(directories)
+        self.result.seconds = time.perf_counter() - start
+        if self.report:
+            save_report(self.report, self.result.report(self.profile))
+        log.info('Build complete: %s' % self.result)
+        return self.result
+
+    def merge(self, count):
+        '''Combine the builds of shards 1 to count of count into the
+        output directory.
+
+        Each shard's output is synced into the output, only copying the
+        files which differ, and the shard manifests are combined into the
+        manifest. Then the listings, which need every post, are generated
+        and outputs which no shard produces any more are removed. The
+        shards can be built anywhere, as long as their output and data
+        directories are brought together here. Returns a BuildResult.
+
+        In staged mode all of this goes to the stage, and is published
+        at the end as update does.
+        '''
+        if self.shard is not None:
+            raise ValueError('Shards are merged without a shard setting')
+        start = time.perf_counter()
+        self.reset_result()
+        if self.staged:
+            shutil.rmtree(self.stage_path, ignore_errors=True)
+            self.deferred = []
+        manifest = self.manifest = Manifest(
+            os.path.join(self.state, 'manifest.json')).load()
+        before = self.all_outputs(manifest)
+        sources = {}
+        synced = {}
+        with self.result.timings.timer('merge'):
+            for index in range(1, count + 1):
+                shard = Manifest(os.path.join(
+                    shard_data(self.data, index, count),
+                    'manifest.json')).load()
+                if not len(shard):
+                    raise ValueError('Shard %d/%d has not been built' %
+                                     (index, count))
+                # Every shard records the files which aren't pages
+                for key, record in shard.sources.items():
+                    if key not in sources or record.get('outputs'):
+                        sources[key] = record
+                synced.update(dict.fromkeys(shard.synced))
+                output = shard_output(self.web_path, index, count)
+                copied, skipped = self.static_sync.sync(
+                    output, self.output_path,
+                    [f for f in files(output) if f != 'generated.txt'],
+                    self.web_path)
+                self.result.written.extend(copied)
+                self.result.skipped.extend(skipped)
+                if self.store is not None:
+                    for path in copied:
+                        self.store.discard(path)
+
+        changed = set(key for key, record in sources.items()
+                      if record['hash'] != manifest.sources.get(
+                          key, {}).get('hash'))
+        changed.update(key for key in manifest.sources if key not in sources)
+        manifest.sources = sources
+        self.static_resources = StaticRegistry()
+        with self.result.timings.timer('collections'):
+            self.collections.update(changed)
+        # No shard renders the listings, so nothing has synced what they
+        # use; unchanged files are skipped
+        registry = StaticRegistry()
+        for output, record in manifest.views.items():
+            for sr in record.get('static', ()):
+                registry.add(registry.normalize(sr), '/' + output)
+        with self.result.timings.timer('static'):
+            self.copy_static(list(registry))
+        synced.update(dict.fromkeys(registry))
+        manifest.synced = list(synced)
+        self.compressor.wait()
+        self.remove_outputs(sorted(before - self.all_outputs(manifest)))
+
+        manifest.generated = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+        self.write_output(os.path.join(self.output_path, 'generated.txt'),
+                          manifest.generated.encode('utf8'))
+        if self.staged:
+            with self.result.timings.timer('publish'):
+                self.publish()
+        manifest.save()
+        self.result.seconds = time.perf_counter() - start
+        log.info('Merged %d shards: %s' % (count, self.result))
+        return self.result
+
+    def all_outputs(self, manifest):
+        '''Every output the manifest records, as a set.'''
+        outputs = set()
+        for record in manifest.sources.values():
+            outputs.update(record.get('outputs', ()))
+        for record in manifest.views.values():
+            outputs.update(record.get('outputs', ()))
+        for sr in manifest.synced:
+            sr = sr.lstrip('/')
+            outputs.add(sr)
+            outputs.update(sr + e for e in self.compressor.extensions)
+        return outputs
+
+    def reset_result(self):
+        '''Start a new BuildResult, timing into it from now on.'''
+        self.result = BuildResult()
+        self.compressor.timings = self.result.timings
+        self.templates.timings = self.result.timings
+
+    def check(self, pages, pending, keys):
+        '''Yield the scanned pages which are new or changed (or pending
+        from a failed build), adding their keys to keys.'''
+        timings = self.result.timings
+        pages = iter(pages)
+        while True:
+            start = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                break
+            key = page.key
+            if self.shard is not None and page.extension in self.parsers \
+                    and shard_of(key, self.shard[1]) != self.shard[0]:
+                # Another shard's page. Every shard records the other files,
+                # as templates and static resources are shared.
+                continue
+            changed = self.manifest.changed(
+                key, os.path.join(self.source, key), page.mtime, page.size)
+            timings.add('scan', time.perf_counter() - start)
+            if changed or key in pending:
+                keys.add(key)
+                yield page
+
+    def save_snapshot(self, directories):
+        '''Record the directory mtimes of a full scan, or forget them
+        after a partial one (directories is None).'''
+        if directories is None:
+            self.snapshot.discard()
+        else:
+            self.snapshot.save(directories, not self.manifest.pending())
+
+    def status(self, quick=False):
+        '''Check whether the source has changed since the last build,
+        without building or changing anything.
+
+        Returns a list of the reasons a rebuild is needed, which is empty
+        if the output is up to date. Only the directories are stat'd if
+        none of them changed since the last full build and quick is set,
+        trusting that files are not edited in place, see
+        pagepress.scanner.DirectorySnapshot. Otherwise the files the last
+        build saw are stat'd too, and hashed if their mtime or size moved.
+        '''
+        snapshot = self.snapshot.load()
+        if snapshot.directories is None:
+            return ['there is no record of a full build']
+        if not snapshot.clean:
+            return ['the last build had errors']
+        reasons = ['directory changed: /%s' % d
+                   for d in snapshot.changed(self.source)]
+        if reasons or quick:
+            return reasons
+        manifest = Manifest(os.path.join(self.state, 'manifest.json')).load()
+        for key, record in manifest.sources.items():
+            page = stat_entry(self.source, key, self.ignore)
+            if page is None:
+                reasons.append('removed: %s' % key)
+            elif (page.mtime, page.size) != (record['mtime'], record['size']):
+                if file_hash(os.path.join(self.source, key)) != \
+                        record['hash']:
+                    reasons.append('changed: %s' % key)
+        return reasons
+
+    def changes(self, paths, pending, directories=None):
+        '''Return the changed pages and the keys of removed sources.
+
+        Only the keys of the scanned files are held while walking the
+        source, not their records.
+        '''
+        manifest = self.manifest
+        if paths is None:
+            seen = set()
+            def pages():
+                for page in scan(self.source, self.ignore, directories):
+                    seen.add(page.key)
+                    yield page
+            changed = list(self.check(pages(), pending, set()))
+            removed = [key for key in manifest.sources if key not in seen]
+            return changed, removed
+        pages = []
+        removed = []
+        for key in set(paths).union(pending):
+            page = stat_entry(self.source, key, self.ignore)
+            if page is not None:
+                pages.append(page)
+            elif key in manifest:
+                removed.append(key)
+        return list(self.check(pages, pending, set())), removed
+
+    def record(self, page):
+        '''Move the outcome of building page from self.built into the
+        manifest, removing any outputs it no longer produces.'''
+        key = page.key
+        built = self.built.pop(key, None)
+        self.page_templates.pop(key, None)
+        if built is not None:
+            self.remove_outputs(self.manifest.built(key, *built))
+        elif page.extension in self.parsers:
+            self.manifest.failed(key)
+        else:
+            self.manifest.built(key, {}, [], [], None)
+
+    def generate_stream(self, pages):
+        '''Build pages one at a time as they arrive from the iterable
+        pages, parse, render, write and record, so that nothing but the
+        manifest grows with the size of the site.
+
+        With more than one job a bounded number of pages are in flight in
+        the worker processes at once.
+        '''
+        generating_time = datetime.now()
+        log.info('Generating files as they are found, as of %s.' %
+                 generating_time)
+        self.built = {}
+        self.parsed = []
+        if self.jobs > 1:
+            self.stream_parallel(pages)
+            return generating_time
         for page in pages:
-            page_defs.append(page)
-            if page['mtime'] > generated:
-                newer = True
+            if page.extension in self.parsers:
+                new_page = self.parse_page(page)
+                if new_page is not None:
+                    self.render_page(new_page)
+                new_page = None
+            self.record(page)
+        self.track(None)
+        self.compressor.wait()
+        return generating_time
 
-        if newer:
-            generate_time = self.generate_all(page_defs)
-            self.copy_static()
-            fp = open(generated_file,'w')
-            fp.write(generate_time.strftime('%d/%m/%Y %H:%M:%S'));
-            fp.close()
+    def stream_parallel(self, pages):
+        executor = ProcessPoolExecutor(max_workers=self.jobs,
+                                       initializer=_init_worker,
+                                       initargs=(self.config,))
+        window = {}
+        def collect(return_when):
+            done, _ = wait(window, return_when=return_when)
+            for future in done:
+                self.merge_built(future.result())
+                self.record(window.pop(future))
+        try:
+            for page in pages:
+                if page.extension not in self.parsers:
+                    self.record(page)
+                    continue
+                if self.warm:
+                    # Only once there is a page to build
+                    self.warm = False
+                    self.compile_templates()
+                future = executor.submit(_build_page, page,
+                                         self.previous_outputs(page.key))
+                window[future] = page
+                if len(window) >= self.jobs * 4:
+                    collect(FIRST_COMPLETED)
+            if window:
+                collect(ALL_COMPLETED)
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+    def merge_built(self, result):
+        '''Merge what _build_page returned from a worker.'''
+        if result is None:
+            return
+        source, built, page_result, static = result
+        self.built[source] = built
+        self.result.merge(page_result)
+        self.static_resources.merge(static)
+        if self.store is not None:
+            for output in page_result.written:
+                self.store.discard(output)
 
     def generate_all(self, pages):
         generating_time = datetime.now()
-        log.info('Generating Site as of %s.' % generating_time)
-        self.pages = []
+        log.info('Generating %d files as of %s.' %
+                 (len(pages), generating_time))
+        self.built = {}
+        if self.jobs > 1 and len(pages) > 1:
+            self.parsed = []
+            self.generate_parallel(pages)
+            return generating_time
+
+        self.parsed = []
         for page in pages:
-            if page['extension'] in self.parsers:
-                filename = os.path.join(self.source, *page['path'])
-                fp = codecs.open(filename, mode="r", encoding='utf8')
-                self.current_path = page['path'][:-1]
-                try:
-                    pagetype, metadata, content = self.parsers[page['extension']].parse(fp)
-                    metadata.update(page)
-                    self.pages.append(self.types[pagetype](
-                                                generator=self,
-                                                content=content,
-                                                **metadata))
-                except Exception as e:
-                    log.error('Could not parse file: %s (%s)' %
-                              ('/'.join(page['path']), e))
-                    if self.stop_on_error:
-                        raise
-            # else:
-            #     fp = open(os.path.join(self.source, *page['path']))
-            #     content = fp.read()
-            #     self.pages.append(File(generator=self, content=content, **page))
-
-        for page in self.pages:
-            try:
-                rendered_file = os.path.join(self.web_path, *page.path)
-                log.debug('Generating File: %s' % rendered_file)
-                try:
-                    rfp = open(rendered_file, mode='w')
-                except IOError as e:
-                    if e.errno == errno.ENOENT:
-                        directory = os.path.dirname(rendered_file)
-                        os.makedirs(directory)
-                        rfp = open(rendered_file, mode='w')
-                    else:
-                        raise e
-                page_content = page.render().encode('utf8')
-                rfp.write(page_content)
-                rfp.close()
-                if not rendered_file.endswith('.gz'):
-                    rfp = gzip.open(rendered_file+'.gz', 'w')
-                    rfp.write(page_content)
-                    rfp.close()
-            except Exception as e:
-                log.error('Error rendering page %s (%s) Turn on template'
-                          ' debugging to assist.' % 
-                              ('/'.join(page.path), e))
-                if self.stop_on_error:
-                    raise
+            new_page = self.parse_page(page)
+            if new_page is not None:
+                self.parsed.append(new_page)
+
+        for page in self.parsed:
+            self.render_page(page)
+        self.track(None)
+        self.compressor.wait()
+        self.page_templates = {}
 
         return generating_time
 
-    def static(self, path):
-        if not path.startswith('/'):
-            if len(self.current_path):
-                path = os.path.join(os.path.join(*self.current_path), path)
-            path = '/'+path
-        if path not in self.static_resources:
-            self.static_resources.append(path)
-        return path
-
-    def copy_static(self):
-        log.debug('Copying Static resources')
-        for sr in self.static_resources:
-            log.debug('copying static %s' % sr)
-            if sr.startswith('/'):
-                sr = sr[1:]
+    def generate_parallel(self, pages):
+        '''Parse and render pages across a pool of worker processes.
+
+        Each worker builds its own Generator from our config, so they
+        share the compiled template modules in the data directory. The
+        results are merged back into self.built.
+        '''
+        log.debug('Generating with %d workers' % self.jobs)
+        if self.warm:
+            self.compile_templates()
+        executor = ProcessPoolExecutor(max_workers=self.jobs,
+                                       initializer=_init_worker,
+                                       initargs=(self.config,))
+        try:
+            futures = [executor.submit(_build_page, page,
+                                       self.previous_outputs(page.key))
+                       for page in pages]
+            for future in as_completed(futures):
+                self.merge_built(future.result())
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+    def compile_templates(self):
+        '''Compile all the templates into the data directory ahead of a
+        build, using the same number of processes as the build.
+
+        Returns the results from pagepress.templates.compile_templates,
+        with any errors logged.
+        '''
+        start = time.perf_counter()
+        results = compile_templates(self.template_options, self.jobs)
+        for uri, seconds, error in results:
+            if error is not None:
+                log.error('Could not compile template %s (%s)' % (uri, error))
+        log.debug('Compiled %d templates in %.2fs' %
+                  (len(results), time.perf_counter() - start))
+        return results
+
+    def parse_page(self, page):
+        '''Create the Page object for a scanned file.
+
+        The parser's output is cached against the file's content, so an
+        unchanged file (rebuilt because a template changed, say) is not
+        parsed again. Returns None if the file has no parser, or could not
+        be parsed.
+        '''
+        if page.extension not in self.parsers:
+            # fp = open(os.path.join(self.source, *page.path))
+            # content = fp.read()
+            # return File(generator=self, content=content, **page)
+            return None
+        source = page.key
+        parser = self.parsers[page.extension]
+        self.current_path = list(page.path[:-1])
+        self.track(source)
+        try:
+            start = time.perf_counter()
+            with open(os.path.join(self.source, *page.path), 'rb') as fp:
+                data = fp.read()
+            digest = hashlib.sha1(data).hexdigest()
+            parsed = self.parse_cache.get(source, digest, parser)
+            if parsed is None:
+                pagetype, metadata, content = parser.parse_text(
+                    data.decode('utf8'))
+                static = self.static_resources.paths(source)
+                self.parse_cache.put(source, digest, parser,
+                                     (pagetype, metadata, content, static))
+                phase = 'parse'
+            else:
+                pagetype, metadata, content, static = parsed
+                for path in static:
+                    self.static(path)
+                phase = 'parse cached'
+            self.result.timings.add(phase, time.perf_counter() - start,
+                                    source, len(data))
+            metadata.update({
+                'path': page.path,
+                'mtime': datetime.fromtimestamp(page.mtime),
+                'extension': page.extension,
+            })
+            new_page = self.types[pagetype](generator=self,
+                                            content=content,
+                                            **metadata)
+            new_page.source = source
+            # The content is in the parse cache now, so it need not be
+            # held until the page is rendered
+            new_page.loader = functools.partial(self.cached_content, source,
+                                                digest, parser)
+            new_page.release()
+            return new_page
+        except Exception as e:
+            log.error('Could not parse file: %s (%s)' %
+                      (source, e))
+            if self.stop_on_error:
+                raise
+
+    def cached_content(self, source, digest, parser):
+        '''The content parser produced from source, whose content hashed
+        to digest, parsing it again if it has gone from the cache.'''
+        parsed = self.parse_cache.get(source, digest, parser)
+        if parsed is None:
+            with open(os.path.join(self.source, *source.split('/')),
+                      'rb') as fp:
+                parsed = parser.parse_text(fp.read().decode('utf8'))
+        return parsed[2]
+
+    def previous_outputs(self, source):
+        '''The outputs, and their content hashes, from the last build of
+        source.'''
+        if self.manifest is None:
+            return {}
+        record = self.manifest.get(source)
+        if record is None:
+            return {}
+        return record.get('outputs', {})
+
+    def render_page(self, page, previous=None):
+        '''Render a page to the output directory, queue its compressed
+        copies, and record what it produced in self.built.
+
+        If the rendered content hashes the same as the previous build's
+        output (and that output is still there) neither file is written.
+
+        Streamed pages (see streams) are written in chunks as they render,
+        compressing as they go, rather than being built up in memory.
+        '''
+        if previous is None:
+            previous = self.previous_outputs(page.source)
+        self.current_path = page.source.split('/')[:-1]
+        self.track(page.source)
+        try:
+            rendered_file = os.path.join(self.output_path, *page.path)
+            output = '/'.join(page.path)
+            if self.streams(page):
+                outputs = self.stream_page(page, rendered_file, output,
+                                           previous)
+            else:
+                start = time.perf_counter()
+                content = page.render().encode('utf8')
+                self.timed_render(page, time.perf_counter() - start,
+                                  len(content))
+                outputs = self.output_content(output, content, previous,
+                                              page.source)
+            self.built[page.source] = (
+                outputs,
+                self.static_resources.paths(page.source),
+                self.template_dependencies(page.source),
+                page.index_record())
+        except Exception as e:
+            log.error('Error rendering page %s (%s) Turn on template'
+                      ' debugging to assist.' % 
+                          ('/'.join(page.path), e))
+            if self.stop_on_error:
+                raise
+        finally:
+            page.release()
+
+    def timed_render(self, page, seconds, size):
+        '''Add the time spent rendering page, to it and its template.'''
+        self.result.timings.add('render', seconds, page.source, size)
+        template = getattr(page, 'template', None)
+        if template is not None:
+            self.result.timings.template(template.uri, 'render', seconds)
+
+    def output_content(self, output, content, previous, source=None):
+        '''Write content to output (a path relative to the output
+        directory) and queue its compressed copies, unless it hashes the
+        same as in previous. Returns the outputs with their hashes. The
+        time spent writing is counted against source, if given.'''
+        rendered_file = os.path.join(self.output_path, *output.split('/'))
+        digest = hashlib.sha1(content).hexdigest()
+        outputs = {output: digest}
+        for sibling in self.compressor.siblings(output, len(content)):
+            outputs[sibling] = digest
+        if self.store is not None:
+            self.store.put(output, content, digest)
+        if self.unchanged(outputs, previous):
+            log.debug('Unchanged File: %s' % rendered_file)
+            self.result.skipped.extend(sorted(outputs))
+        else:
+            log.debug('Generating File: %s' % rendered_file)
+            start = time.perf_counter()
+            self.write_output(rendered_file, content)
+            self.result.timings.add('write', time.perf_counter() - start,
+                                    source, len(content))
+            self.compressor.submit(rendered_file, content)
+            self.result.written.extend(sorted(outputs))
+        return outputs
+
+    def page_content(self, source):
+        '''The parsed content of source as of the last build, from the
+        parse cache if it is there (it won't be when merging shards built
+        elsewhere), or None if source was not built.'''
+        record = self.manifest.get(source) if self.manifest else None
+        parser = self.parsers.get(os.path.splitext(source)[1])
+        if record is None or parser is None:
+            return None
+        return self.cached_content(source, record['hash'], parser)
+
+    def streams(self, page):
+        '''Whether to stream a page to disk, either because the config
+        says to stream everything or the page has 'stream: yes'.'''
+        if self.stream:
+            return True
+        stream = page.metadata.get('stream', '')
+        return str(stream).strip().lower() in ('1', 'true', 't', 'y', 'yes', 'on')
+
+    def stream_page(self, page, rendered_file, output, previous):
+        '''Render page through a StreamWriter, returning its outputs.'''
+        codecs = self.compressor.outputs(output, self.compressor.min_size)
+        writer = StreamWriter(rendered_file, codecs, self.stream_chunk)
+        start = time.perf_counter()
+        try:
+            page.render_to(writer)
+            digest = writer.close()
+        except Exception:
+            writer.discard()
+            raise
+        # Writing and compressing are interleaved with rendering here
+        self.timed_render(page, time.perf_counter() - start, writer.size)
+        compressed = writer.size >= self.compressor.min_size
+        outputs = {output: digest}
+        if compressed:
+            for codec in codecs:
+                outputs[output + codec.extension] = digest
+        if self.store is not None:
+            self.store.discard(output)
+        if self.unchanged(outputs, previous):
+            log.debug('Unchanged File: %s' % rendered_file)
+            writer.discard()
+            self.result.skipped.extend(sorted(outputs))
+        else:
+            log.debug('Streamed File: %s' % rendered_file)
+            writer.commit(compressed)
+            self.result.written.extend(sorted(outputs))
+        return outputs
+
+    def unchanged(self, outputs, previous):
+        '''Whether every output has the same hash as last build, and is
+        still on disk.'''
+        return all(previous.get(o) == digest and
+                   os.path.exists(os.path.join(self.web_path, o))
+                   for o, digest in outputs.items())
+
+    def track(self, source):
+        '''Attribute static resources and templates used from now on to
+        the given source file.'''
+        self.current_source = source
+        if source is None:
+            self.templates.record(None)
+        else:
+            self.templates.record(
+                self.page_templates.setdefault(source, set()))
+
+    def template_dependencies(self, source):
+        '''The templates used by source, as paths relative to the source
+        directory where possible.'''
+        dependencies = []
+        for filename in self.page_templates.pop(source, ()):
+            relative = os.path.relpath(filename, self.source)
+            if not relative.startswith(os.pardir):
+                filename = '/'.join(relative.split(os.sep))
+            dependencies.append(filename)
+        return sorted(dependencies)
+
+    def write_output(self, rendered_file, content):
+        try:
+            rfp = open(rendered_file, mode='wb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                # Worker processes may be creating the same directory
+                directory = os.path.dirname(rendered_file)
+                os.makedirs(directory, exist_ok=True)
+                rfp = open(rendered_file, mode='wb')
+            else:
+                raise e
+        rfp.write(content)
+        rfp.close()
+
+    def remove_outputs(self, outputs):
+        '''Delete outputs, or in staged mode, delete them when the build
+        is published.'''
+        if self.deferred is not None:
+            self.deferred.extend(outputs)
+            return
+        self.delete_outputs(outputs)
+
+    def delete_outputs(self, outputs):
+        for output in outputs:
+            log.debug('Removing stale output %s' % output)
+            if self.store is not None:
+                self.store.discard(output)
             try:
-                shutil.copy(os.path.join(self.source, sr), 
-                            os.path.join(self.web_path, sr))
-            except IOError as e:
-                if e.errno == errno.ENOENT:
-                    directory = os.path.dirname(os.path.join(self.web_path, sr))
-                    os.makedirs(directory)
-                    shutil.copy(os.path.join(self.source, sr), 
-                                os.path.join(self.web_path, sr))
-                else:
+                os.remove(os.path.join(self.web_path, output))
+                self.result.deleted.append(output)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
                     raise
 
+    def publish(self):
+        '''Move everything written to the stage into the output directory,
+        then delete the outputs removed by the build.
+
+        Each file is moved with os.replace, so a reader sees either the
+        old file or the new one, never part of either. Pages go after
+        everything else, so the resources a new page uses are in place
+        before it is. Only the files this build wrote are on the stage,
+        so this is O(changes).
+        '''
+        published = []
+        for root, dirs, files in os.walk(self.stage_path):
+            relative = os.path.relpath(root, self.stage_path)
+            prefix = '' if relative == os.curdir else \
+                '/'.join(relative.split(os.sep)) + '/'
+            published.extend(prefix + name for name in files)
+        published.sort(key=lambda output: (output.endswith('.html'), output))
+        directories = set(os.path.dirname(output) for output in published)
+        for directory in sorted(directories):
+            os.makedirs(os.path.join(self.web_path, *directory.split('/')),
+                        exist_ok=True)
+        for output in published:
+            parts = output.split('/')
+            os.replace(os.path.join(self.stage_path, *parts),
+                       os.path.join(self.web_path, *parts))
+        log.debug('Published %d files' % len(published))
+        published = set(published)
+        deferred, self.deferred = self.deferred, []
+        self.delete_outputs([output for output in deferred
+                             if output not in published])
+        shutil.rmtree(self.stage_path, ignore_errors=True)
+
+    def static(self, path):
+        '''Register a static resource to copy to the output, relative to
+        the current page unless it starts with /. Returns its path from
+        the root of the site.'''
+        path = self.static_resources.normalize(path, self.current_path)
+        return self.static_resources.add(path, self.current_source)
+
+    def prune_static(self, previous):
+        '''Remove the outputs of static resources synced last build which
+        nothing references any more.'''
+        for sr in previous:
+            if sr not in self.static_resources:
+                sr = sr.lstrip('/')
+                log.debug('Static resource %s is no longer used' % sr)
+                self.remove_outputs([sr] + [sr + extension for extension
+                                            in self.compressor.extensions])
+
+    def copy_static(self, resources=None):
+        '''Sync the static resources (all of them, by default) into the
+        output, see pagepress.static.StaticSync. Copied files are
+        compressed, as are unchanged ones missing a compressed copy.'''
+        log.debug('Copying Static resources')
+        if resources is None:
+            resources = self.static_resources
+        copied, skipped = self.static_sync.sync(self.source, self.output_path,
+                                                resources, self.web_path)
+        for sr in copied:
+            sr = sr.lstrip('/')
+            self.result.written.append(sr)
+            if self.store is not None:
+                self.store.discard(sr)
+            self.compressor.submit(os.path.join(self.output_path, sr))
+        for sr in skipped:
+            sr = sr.lstrip('/')
+            self.result.skipped.append(sr)
+            self.compress_missing(sr)
+        self.compressor.wait()
 
+    def compress_missing(self, sr):
+        '''Compress an unchanged static resource if any of its compressed
+        copies is missing from the output, as after a codec is added.'''
+        codecs = self.compressor.outputs(sr, self.compressor.min_size)
+        if not codecs:
+            return
+        parts = sr.split('/')
+        current = os.path.join(self.web_path, *parts)
+        if all(os.path.exists(current + codec.extension)
+               for codec in codecs):
+            return
+        with open(current, 'rb') as fp:
+            data = fp.read()
+        siblings = self.compressor.siblings(sr, len(data))
+        if not siblings:
+            return
+        rendered_file = os.path.join(self.output_path, *parts)
+        os.makedirs(os.path.dirname(rendered_file), exist_ok=True)
+        self.compressor.submit(rendered_file, data)
+        self.result.written.extend(siblings)
@@ -0,0 +1,164 @@
+import os, json, time, logging, threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class Timings(object):
+    '''Where a build's time went.
+
+    For each phase (scan, parse, render, write, compress, static...) the
+    total seconds, how many times it ran and the bytes it produced, plus
+    the seconds each page spent in each phase and each template spent
+    compiling and rendering. Compression runs in threads, so adding is
+    locked. Timings from worker processes are merged in with merge().
+    '''
+    def __init__(self):
+        self.phases = {}
+        self.pages = {}
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add(self, phase, seconds, page=None, size=0):
+        with self.lock:
+            totals = self.phases.setdefault(phase, [0.0, 0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+            totals[2] += size
+            if page is not None:
+                phases = self.pages.setdefault(page, {})
+                phases[phase] = phases.get(phase, 0.0) + seconds
+
+    def template(self, uri, phase, seconds):
+        '''Add to the seconds spent by a template in compile or render.'''
+        with self.lock:
+            phases = self.templates.setdefault(uri, {})
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase, page=None):
+        '''Time the block as phase, for page if given.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, page)
+
+    def merge(self, other):
+        with self.lock:
+            for phase, (seconds, count, size) in other.phases.items():
+                totals = self.phases.setdefault(phase, [0.0, 0, 0])
+                totals[0] += seconds
+                totals[1] += count
+                totals[2] += size
+            for mine, theirs in ((self.pages, other.pages),
+                                 (self.templates, other.templates)):
+                for key, phases in theirs.items():
+                    into = mine.setdefault(key, {})
+                    for phase, seconds in phases.items():
+                        into[phase] = into.get(phase, 0.0) + seconds
+
+    def slowest(self, items, count):
+        totals = [(key, sum(phases.values()), phases)
+                  for key, phases in items.items()]
+        totals.sort(key=lambda t: t[1], reverse=True)
+        return totals[:count]
+
+    def slowest_pages(self, count=10):
+        '''(source, seconds, {phase: seconds}) for the slowest pages.'''
+        return self.slowest(self.pages, count)
+
+    def slowest_templates(self, count=10):
+        return self.slowest(self.templates, count)
+
+    def report(self, result=None, seconds=None, count=10):
+        '''The timings as a dict, ready to be dumped as JSON.'''
+        report = {
+            'phases': dict((phase, {'seconds': s, 'count': c, 'bytes': b})
+                           for phase, (s, c, b) in self.phases.items()),
+            'slowest_pages': [
+                {'source': key, 'seconds': total, 'phases': phases}
+                for key, total, phases in self.slowest_pages(count)],
+            'slowest_templates': [
+                {'template': key, 'seconds': total, 'phases': phases}
+                for key, total, phases in self.slowest_templates(count)],
+        }
+        if seconds is not None:
+            report['seconds'] = seconds
+        if result is not None:
+            report['written'] = len(result.written)
+            report['skipped'] = len(result.skipped)
+            report['deleted'] = len(result.deleted)
+        return report
+
+    def summary(self, count=10):
+        '''Lines of text listing the phases and the slowest pages and
+        templates.'''
+        lines = ['%-12s %9s %7s %12s' % ('phase', 'seconds', 'count', 'bytes')]
+        for phase, (seconds, number, size) in sorted(
+                self.phases.items(), key=lambda p: p[1][0], reverse=True):
+            lines.append('%-12s %9.3f %7d %12d' % (phase, seconds, number,
+                                                   size))
+        for title, slowest in (('pages', self.slowest_pages(count)),
+                               ('templates', self.slowest_templates(count))):
+            if not slowest:
+                continue
+            lines.append('')
+            lines.append('Slowest %s' % title)
+            for key, total, phases in slowest:
+                lines.append('%9.1fms %s (%s)' % (total * 1000, key, ', '.join(
+                    '%s %.1fms' % (p, s * 1000)
+                    for p, s in sorted(phases.items()))))
+        return lines
+
+
+def save_report(filename, report):
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(filename, 'w') as fp:
+        json.dump(report, fp, indent=2, sort_keys=True)
+
+
+@contextmanager
+def capture(cprofile=None, tracemalloc_top=0, report=None):
+    '''Optionally run the block under cProfile, writing the stats to the
+    file cprofile, and/or tracemalloc, putting the tracemalloc_top biggest
+    allocation sites in report['allocations'].'''
+    profiler = None
+    if tracemalloc_top:
+        import tracemalloc
+        tracemalloc.start()
+    if cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+            log.info('Wrote profile to %s' % cprofile)
+        if tracemalloc_top:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if report is not None:
+                report['allocations'] = {
+                    'current': current,
+                    'peak': peak,
+                    'top': [{'file': str(stat.traceback), 'bytes': stat.size,
+                             'count': stat.count}
+                            for stat in snapshot.statistics('lineno')[
+                                :tracemalloc_top]],
+                }
@@ -0,0 +1,155 @@
+import os, json, hashlib, logging
+
+log = logging.getLogger(__name__)
+
+
+def file_hash(filename):
+    '''Return the sha1 hex digest of a file's contents, read in chunks.'''
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest(object):
+    '''Persistent record of the last build.
+
+    Every file seen in the source directory is recorded against its
+    '/' separated path, along with the mtime, size and content hash it
+    had when it was last built, the output files it produced (with the
+    hash of their content), the static resources it referenced, the
+    templates it was rendered with and, for pages which are listed in the
+    index, their index record. The listings generated from those records
+    are kept under views, see pagepress.collection, the static resources
+    copied to the output under synced, and the extensions of the
+    compressed copies made of them under compressed.
+
+    The mtime and size are compared first, and only when they differ is
+    the file hashed, so touching a file without changing it does not
+    trigger a rebuild.
+    '''
+    version = 3
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.sources = {}
+        self.views = {}
+        self.synced = []
+        self.compressed = None
+        self.generated = None
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as fp:
+                data = json.load(fp)
+        except (IOError, ValueError) as e:
+            log.debug('No usable build manifest at %s (%s)' %
+                      (self.filename, e))
+            return self
+        if data.get('version') != self.version:
+            log.info('Build manifest is from another version, ignoring it')
+            return self
+        self.sources = data['sources']
+        self.views = data.get('views', {})
+        self.synced = data.get('synced', [])
+        self.compressed = data.get('compressed')
+        self.generated = data.get('generated')
+        return self
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp = self.filename + '.tmp'
+        with open(temp, 'w') as fp:
+            json.dump({
+                'version': self.version,
+                'generated': self.generated,
+                'sources': self.sources,
+                'views': self.views,
+                'synced': self.synced,
+                'compressed': self.compressed,
+            }, fp, sort_keys=True)
+        os.replace(temp, self.filename)
+
+    def __contains__(self, key):
+        return key in self.sources
+
+    def __len__(self):
+        return len(self.sources)
+
+    def get(self, key):
+        return self.sources.get(key)
+
+    def changed(self, key, filename, mtime, size):
+        '''Check a source file against the manifest.
+
+        Returns True if the file is new or its contents differ from the
+        last build. The stored mtime is refreshed when only the mtime
+        moved, so the file is not hashed again next time.
+        '''
+        record = self.sources.get(key)
+        if record is not None and record['mtime'] == mtime \
+                and record['size'] == size:
+            return False
+        digest = file_hash(filename)
+        if record is not None and record['hash'] == digest:
+            record['mtime'] = mtime
+            record['size'] = size
+            return False
+        if record is None:
+            record = self.sources[key] = {'outputs': {}, 'static': [],
+                                          'templates': []}
+        record.update({'mtime': mtime, 'size': size, 'hash': digest})
+        # Until it is built successfully the file counts as changed
+        record['built'] = False
+        return True
+
+    def pending(self):
+        '''Sources recorded as changed but not yet successfully built.'''
+        return [key for key, record in self.sources.items()
+                if not record.get('built', True)]
+
+    def built(self, key, outputs, static, templates, post=None):
+        '''Record a successful build of key, returning any outputs
+        which were produced last time but not this time.'''
+        record = self.sources[key]
+        stale = [o for o in record.get('outputs', {}) if o not in outputs]
+        record['outputs'] = outputs
+        record['static'] = static
+        record['templates'] = templates
+        if post is None:
+            record.pop('post', None)
+        else:
+            record['post'] = post
+        record['built'] = True
+        return stale
+
+    def failed(self, key):
+        '''Mark key to be built again on the next update.'''
+        self.sources[key]['built'] = False
+
+    def remove(self, key):
+        '''Forget about a source, returning the outputs it produced.'''
+        record = self.sources.pop(key, None)
+        if record is None:
+            return []
+        return list(record.get('outputs', {}))
+
+    def dependents(self, keys):
+        '''Sources which were rendered with any of the given templates.'''
+        keys = set(keys)
+        for key, record in self.sources.items():
+            if keys.intersection(record.get('templates', ())):
+                yield key
+
+    def static_resources(self):
+        '''Yield (source, resource) for every static resource referenced
+        by a recorded source or view, views being given as '/' + output.'''
+        for key, record in self.sources.items():
+            for sr in record.get('static', []):
+                yield key, sr
+        for output, record in self.views.items():
+            for sr in record.get('static', []):
+                yield '/' + output, sr
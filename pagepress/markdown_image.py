@@ -1,7 +1,6 @@
-
 import re
 import markdown
-from markdown.util import etree
+import xml.etree.ElementTree as etree
 
 
 class ImageBlockProcessor(markdown.blockprocessors.BlockProcessor):
@@ -16,7 +15,7 @@ class ImageBlockProcessor(markdown.blockprocessors.BlockProcessor):
         block = blocks.pop(0)
         try:
             header, block = block.split('\n', 1)
-        except ValueError, e:
+        except ValueError as e:
             header = block.strip()
             block = ''
 
@@ -26,7 +25,7 @@ class ImageBlockProcessor(markdown.blockprocessors.BlockProcessor):
         self.parser.parseBlocks(ib, [self.looseDetab(block)])
         self.parser.state.reset()
 
-IMAGE_PATTERN = '\&\[(.+?)\]\[(.+?)\](\[(.+?)\])?'
+IMAGE_PATTERN = r'\&\[(.+?)\]\[(.+?)\](\[(.+?)\])?'
 class ImagePattern(markdown.inlinepatterns.Pattern):
     """ Process Links with a & 
     
@@ -38,21 +37,21 @@ class ImagePattern(markdown.inlinepatterns.Pattern):
     """
 
     def handleMatch(self, m):
-        id_1 = m.group(2)
-        id_2 = m.group(3)
-        if not id_1 in self.markdown.references: 
+        id_1 = m.group(2).lower()
+        id_2 = m.group(3).lower()
+        if not id_1 in self.md.references: 
             return None
-        if not id_2 in self.markdown.references: 
+        if not id_2 in self.md.references: 
             return None
-        href_1, title_1 = self.markdown.references[id_1]
-        href_2, title_2 = self.markdown.references[id_2]
+        href_1, title_1 = self.md.references[id_1]
+        href_2, title_2 = self.md.references[id_2]
         
         a = etree.Element('a')
         img = etree.SubElement(a, 'img')
         a.attrib['href'] = href_2
-        a.attrib['title'] = title_2
+        a.attrib['title'] = title_2 or ''
         img.attrib['src'] = href_1
-        img.attrib['alt'] = title_1
+        img.attrib['alt'] = title_1 or ''
         if m.group(5) is not None:
             a.attrib['data-fancybox-group'] = m.group(5)
         return a
@@ -60,12 +59,10 @@ class ImagePattern(markdown.inlinepatterns.Pattern):
 class ImageExtension(markdown.Extension):
     """ Add Image Blocks to Markdown. """
 
-    def extendMarkdown(self, md, md_globals):
-        md.parser.blockprocessors.add('imageblock', 
-                                      ImageBlockProcessor(md.parser),
-                                     '<paragraph')
-        md.inlinePatterns.add('imageblocklink', 
-                              ImagePattern(IMAGE_PATTERN, md), 
-                              '_begin')
-
-
+    def extendMarkdown(self, md):
+        # Just ahead of paragraphs
+        md.parser.blockprocessors.register(ImageBlockProcessor(md.parser),
+                                           'imageblock', 11)
+        # Ahead of everything else
+        md.inlinePatterns.register(ImagePattern(IMAGE_PATTERN, md),
+                                   'imageblocklink', 200)
@@ -1,19 +1,49 @@
 
-import datetime
+import sys, datetime
+from mako.runtime import Context
 
 class File(object):
+    '''A file in the source, and what it becomes in the output.
+
+    Pages are kept for the whole of a build, so they are kept small:
+    attributes are slots, path is a tuple of interned components (shared
+    between every page in a directory) and the content can be dropped
+    with release() and loaded again on demand, see content.
+    '''
+    __slots__ = ('generator', 'path', 'mtime', 'metadata', 'source',
+                 'loader', '_content')
     type = 'file'
     def __init__(self, generator, path, mtime, content, **metadata):
         self.generator = generator
-        self.path = path
-        self.content = content
+        self.path = tuple(sys.intern(p) for p in path)
+        self._content = content
+        self.loader = None
+        self.source = None
         self.mtime = mtime
         self.metadata = metadata
 
+    @property
+    def content(self):
+        '''The parsed content. If it has been released it is fetched again
+        with loader, a function of no arguments.'''
+        content = self._content
+        if content is None and self.loader is not None:
+            content = self._content = self.loader()
+        return content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    def release(self):
+        '''Drop the content if it can be loaded again.'''
+        if self.loader is not None:
+            self._content = None
+
     def change_extension(self, extension):
         i = self.path[-1].rfind('.')
         basename = self.path[-1][0:i]
-        self.path[-1] = basename + extension
+        self.path = self.path[:-1] + (basename + extension,)
 
     def url(self):
         return '/' + '/'.join(self.path)
@@ -21,20 +51,31 @@ class File(object):
     def render(self, **kwargs):
         return self.content
 
+    def render_to(self, buffer):
+        '''Render into buffer, a file-like object taking str.'''
+        buffer.write(self.render())
+
+    def index_record(self):
+        '''What the collections index keeps for this page, or None if it
+        is not listed. See pagepress.collection.'''
+        return None
+
 class Page(File):
+    __slots__ = ()
     type = 'page'
     def __init__(self, generator, path, mtime, content, **kwargs):
         super(Page, self).__init__(generator, path, mtime, content, **kwargs)
 
 class Templated(Page):
+    __slots__ = ('template',)
     template_extension = '.mako'
     type = 'templated'
     def __init__(self, generator, **kwargs):
         template_name = kwargs.pop('template', None)
         Page.__init__(self, generator, **kwargs)
-        
+
         if not template_name:
-            template_path = self.path[:]
+            template_path = list(self.path)
             i = self.path[-1].rfind('.')
             basename = self.path[-1][0:i]
             template_path[-1] = basename + self.template_extension
@@ -53,10 +94,16 @@ class Templated(Page):
     def render(self, **kwargs):
         return self.template.render_unicode(pagepress=self.generator, page=self)
 
+    def render_to(self, buffer):
+        self.template.render_context(
+            Context(buffer, pagepress=self.generator, page=self))
+
 class HTML(Templated):
+    __slots__ = ()
     type = 'html'
 
 class Blog(HTML):
+    __slots__ = ('title', 'published', 'tags')
     type = 'blog'
     def __init__(self, **kwargs):
         self.title = kwargs.pop('title')
@@ -64,13 +111,28 @@ class Blog(HTML):
         if self.published is not None:
             day, month, year = [int(i) for i in self.published.split('/')]
             self.published = datetime.date(year, month, day)
+        tags = kwargs.pop('tags', '')
+        self.tags = [t.strip() for t in tags.split(',') if t.strip()]
         HTML.__init__(self, **kwargs)
 
+    def index_record(self):
+        published = self.published
+        if published is not None:
+            published = published.isoformat()
+        return {
+            'url': self.url(),
+            'title': self.title,
+            'published': published,
+            'tags': self.tags,
+        }
+
 class Stylesheet(File):
+    __slots__ = ()
     def __init__(self, **kwargs):
         super(Stylesheet, self).__init__(**kwargs)
 
 class Javascript(File):
+    __slots__ = ()
     def __init__(self, **kwargs):
         super(Javascript, self).__init__(**kwargs)
 
@@ -1,49 +1,126 @@
 
 import logging
-# from markdown import Markdown as MarkdownParser
-# from markdown_image import ImageExtension
+from queue import LifoQueue, Empty
+from markdown import Markdown as MarkdownParser
+from pagepress.markdown_image import ImageExtension
 
 log = logging.getLogger(__name__)
 
 class Parser:
     default_page = 'page'
+    # Bump this when a change to a parser changes its output, so that
+    # cached results from the old version are not used
+    version = 2
     def __init__(self, generator):
         self.generator = generator
 
-    def read_intercept_head(self, meta, fp):
-        for line in fp:
-            try:
-                name, value = line.split(':', 1)
-                meta[name.lower()] = value.strip()
-            except Exception as e:
-                yield line
+    def split_head(self, meta, text):
+        '''Read the metadata at the top of text into meta, returning the
+        body as a slice of text.
+
+        The head is either a block of 'name: value' lines between two
+        '---' lines (as the Jekyll style layouts use), or simply the
+        'name: value' lines at the start of the text. In the latter case
+        the first line without a ':' starts the body.
+        '''
+        if text.startswith('---') and text[3:4] in ('\n', '\r', ''):
+            end = text.find('\n---', 3)
+            if end != -1:
+                body = text.find('\n', end + 4)
+                body = len(text) if body == -1 else body + 1
+                self.read_head(meta, text[text.find('\n') + 1:end])
+                return text[body:]
+        position = 0
+        length = len(text)
+        while position < length:
+            end = text.find('\n', position)
+            if end == -1:
+                end = length
+            colon = text.find(':', position, end)
+            if colon == -1:
                 break
-        for line in fp:
-            yield line
+            meta[text[position:colon].lower()] = text[colon + 1:end].strip()
+            position = end + 1
+        return text[position:]
 
-    def parse(self, fp):
+    def read_head(self, meta, head):
+        for line in head.splitlines():
+            name, colon, value = line.partition(':')
+            if not colon or not name.strip() or name[0:1] == '#':
+                continue
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"':
+                value = value[1:-1]
+            meta[name.strip().lower()] = value
+
+    def parse_text(self, text):
         meta = {}
-        content = u''.join([l for l in self.read_intercept_head(meta, fp)])
+        content = self.split_head(meta, text)
         pagetype = meta.pop('type', self.default_page) 
         return pagetype, meta, content
 
+    def parse(self, fp):
+        return self.parse_text(fp.read())
+
 class Markdown(Parser):
+    '''Markdown, with tables and our image blocks.
+
+    Setting up a markdown.Markdown instance (and its extensions) costs
+    more than converting a typical page, so converters are kept in a pool
+    and reset between uses rather than being made for every page. The
+    pool is per Parser, so each worker process has its own.
+    '''
+    default_page = 'templated'
+    version = 3
+
     def __init__(self, generator):
         self.generator = generator
-        self.markdown = MarkdownParser(
-                            output_format='html5',
-                            extensions = ['tables',
-                                          ImageExtension()],
-                        )
-    def parse(self, fp):
+        self.pool = LifoQueue()
+
+    def converter(self):
+        '''Take a converter from the pool, making one if it is empty.'''
+        try:
+            return self.pool.get_nowait()
+        except Empty:
+            return MarkdownParser(
+                        output_format='html',
+                        extensions = ['tables',
+                                      ImageExtension()],
+                    )
+
+    def release(self, converter):
+        converter.reset()
+        self.pool.put(converter)
+
+    def convert(self, text):
+        '''Convert text, returning the html and the references
+        (id: (href, title)) it defined.'''
+        converter = self.converter()
+        try:
+            return converter.convert(text), dict(converter.references)
+        finally:
+            self.release(converter)
+
+    def convert_many(self, texts):
+        '''Convert a batch of texts with a single converter, returning
+        a list of html.'''
+        converter = self.converter()
+        try:
+            result = []
+            for text in texts:
+                result.append(converter.convert(text))
+                converter.reset()
+            return result
+        finally:
+            self.release(converter)
+
+    def parse_text(self, text):
         meta = {}
-        
-        content = self.markdown.convert(''.join(self.read_intercept_head(meta, fp)))
-        for href, title in self.markdown.references.itervalues():
+        content, references = self.convert(self.split_head(meta, text))
+        for href, title in references.values():
             if ':' not in href:
                 self.generator.static(href)
-        self.markdown.reset()
-        pagetype = meta.pop('type', 'templated') # Default Pagetype
+        pagetype = meta.pop('type', self.default_page)
         return pagetype, meta, content
 
 class CSS(Parser):
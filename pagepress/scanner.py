@@ -0,0 +1,159 @@
+import os, json, logging
+from stat import S_ISREG
+from collections import namedtuple
+from fnmatch import fnmatch
+
+log = logging.getLogger(__name__)
+
+
+class Entry(namedtuple('Entry', 'path mtime size inode')):
+    '''A file found by scan.
+
+    path is a tuple of path components relative to the scanned directory,
+    mtime is the raw float timestamp from stat.
+    '''
+    __slots__ = ()
+
+    @property
+    def key(self):
+        return '/'.join(self.path)
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.path[-1])[1]
+
+
+def ignored(name, relative, patterns):
+    '''Whether a file or directory matches any of the ignore patterns.
+
+    Patterns are shell style, and are matched against both the name and
+    the '/' separated path relative to the scanned directory.
+    '''
+    for pattern in patterns:
+        if fnmatch(name, pattern) or fnmatch(relative, pattern):
+            return True
+    return False
+
+
+def stat_entry(base, key, ignore=()):
+    '''The Entry for a single '/' separated path beneath base.
+
+    Returns None if the file does not exist, or would not have been
+    returned by scan (it is in a hidden directory or ignored).
+    '''
+    path = tuple(key.split('/'))
+    for i, name in enumerate(path):
+        if i < len(path) - 1 and name[0:1] == '.':
+            return None
+        if ignore and ignored(name, '/'.join(path[:i + 1]), ignore):
+            return None
+    try:
+        stat = os.stat(os.path.join(base, *path))
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    return Entry(path, stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def scan(base, ignore=(), directories=None):
+    '''Walk base yielding an Entry for every file beneath it.
+
+    This uses os.scandir, so directories are recognised from the
+    directory listing itself and each file is stat'd exactly once.
+    Hidden directories (starting with a '.') are skipped, as are any
+    files or directories matching the ignore patterns.
+
+    If directories is a dict, the mtime (in ns) of every directory walked
+    is put in it, taken before the directory is listed, keyed by its '/'
+    separated path ('' for base). See DirectorySnapshot.
+    '''
+    stack = [()]
+    while stack:
+        path = stack.pop()
+        directory = os.path.join(base, *path)
+        try:
+            if directories is not None:
+                directories['/'.join(path)] = os.stat(directory).st_mtime_ns
+            it = os.scandir(directory)
+        except FileNotFoundError:
+            # Removed while we were scanning
+            continue
+        with it:
+            for entry in it:
+                name = entry.name
+                if ignore and ignored(name, '/'.join(path + (name,)), ignore):
+                    continue
+                try:
+                    if entry.is_dir():
+                        if name[0:1] != '.':
+                            stack.append(path + (name,))
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.is_file():
+                    yield Entry(path + (name,), stat.st_mtime, stat.st_size,
+                                stat.st_ino)
+
+
+class DirectorySnapshot(object):
+    '''The mtimes of every directory in the source at the last full scan.
+
+    Adding, removing or renaming a file changes the mtime of the directory
+    holding it, and so does saving a file the way most editors do (writing
+    a new file and renaming it over the old one). So if no directory's
+    mtime has moved, no file has been added or removed, and most likely
+    none has been edited, which is found out by stat'ing the directories
+    alone, without listing any of them.
+
+    clean records whether that scan's build left nothing to be rebuilt.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.directories = None
+        self.clean = False
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as fp:
+                data = json.load(fp)
+            self.directories = data['directories']
+            self.clean = data['clean']
+        except (IOError, ValueError, KeyError) as e:
+            log.debug('No usable directory snapshot at %s (%s)' %
+                      (self.filename, e))
+            self.directories = None
+        return self
+
+    def save(self, directories, clean):
+        self.directories = directories
+        self.clean = clean
+        temp = self.filename + '.tmp'
+        with open(temp, 'w') as fp:
+            json.dump({'directories': directories, 'clean': clean}, fp)
+        os.replace(temp, self.filename)
+
+    def discard(self):
+        '''Forget the snapshot, as the source was not fully scanned.'''
+        self.directories = None
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+    def changed(self, base):
+        '''The directories whose mtime differs from the snapshot, or which
+        are gone. Every directory is listed if there is no snapshot.'''
+        if self.directories is None:
+            return ['']
+        changed = []
+        for directory, mtime in self.directories.items():
+            try:
+                stat = os.stat(os.path.join(base, *directory.split('/')))
+            except (FileNotFoundError, NotADirectoryError):
+                changed.append(directory)
+                continue
+            if stat.st_mtime_ns != mtime:
+                changed.append(directory)
+        return changed
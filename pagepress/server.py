@@ -0,0 +1,374 @@
+import os, io, json, hashlib, logging, posixpath, threading
+from collections import deque
+from urllib.parse import unquote, urlsplit, urlunsplit
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from pagepress.watch import watcher
+from pagepress.store import OutputStore, StoredOutput
+from pagepress.compress import Gzip
+
+log = logging.getLogger(__name__)
+
+
+class Rebuilder(object):
+    '''Runs Generator.update in a background thread.
+
+    A request for a rebuild is satisfied by the next rebuild to start
+    after it was made, so any number of requests arriving while a rebuild
+    is running coalesce onto a single follow up rebuild, rather than each
+    scanning the source themselves.
+
+    With a watcher, a rebuild only looks at the paths the watcher saw
+    change, and requests only need to wait when something has changed.
+    '''
+    def __init__(self, generator, watcher=None):
+        self.generator = generator
+        self.watcher = watcher
+        self.listeners = []
+        self.condition = threading.Condition()
+        self.wanted = 0
+        self.started = 0
+        self.finished = 0
+        self.result = None
+        self.thread = threading.Thread(target=self.run,
+                                       name='pagepress-rebuild')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self):
+        '''Ask for a rebuild, returning a ticket to wait on.'''
+        with self.condition:
+            ticket = self.started + 1
+            if ticket > self.wanted:
+                self.wanted = ticket
+                self.condition.notify_all()
+            return ticket
+
+    def wait(self, ticket, timeout=None):
+        '''Wait until the rebuild for ticket has finished. Returns False
+        if the timeout passed first.'''
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.finished >= ticket, timeout)
+
+    def rebuild(self, timeout=None):
+        '''Request a rebuild and wait for it.'''
+        return self.wait(self.request(), timeout)
+
+    @property
+    def needed(self):
+        '''Whether a request should wait for a rebuild before serving.'''
+        if self.watcher is None or self.watcher.dirty:
+            return True
+        with self.condition:
+            return self.wanted > self.finished
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.wanted > self.started)
+                self.started += 1
+                number = self.started
+            try:
+                if self.watcher is None:
+                    self.result = self.generator.update()
+                else:
+                    paths, full = self.watcher.take()
+                    if full:
+                        self.result = self.generator.update()
+                    elif paths:
+                        self.result = self.generator.update(paths)
+                    else:
+                        self.result = None
+                if self.result is not None:
+                    for listener in self.listeners:
+                        listener(self.result)
+            except Exception as e:
+                log.exception('Error generating site (%s)' % e)
+            with self.condition:
+                self.finished = number
+                self.condition.notify_all()
+
+
+class LiveReload(object):
+    '''Publishes the output URLs changed by each build to browsers.
+
+    Every build is numbered, and the last few are kept so a client which
+    was busy writing out one event still sees the next ones.
+    '''
+    path = '/__pagepress__/events'
+    script_path = '/__pagepress__/livereload.js'
+    # Seconds between keep alive comments on an idle connection
+    keep_alive = 15
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.events = deque(maxlen=50)
+
+    def __call__(self, result):
+        '''Rebuilder listener, publishing the URLs a build changed.'''
+        extensions = self.generator.compressor.extensions
+        urls = sorted(set('/' + path
+                          for path in result.written + result.deleted
+                          if os.path.splitext(path)[1] not in extensions))
+        if urls:
+            self.publish(urls)
+
+    def publish(self, urls):
+        with self.condition:
+            self.sequence += 1
+            self.events.append((self.sequence, urls))
+            self.condition.notify_all()
+
+    def wait(self, sequence, timeout=None):
+        '''Return the events after sequence, waiting up to timeout for
+        one to arrive.'''
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > sequence,
+                                    timeout)
+            return [event for event in self.events if event[0] > sequence]
+
+    def inject(self, content):
+        '''Add the live reload script to an HTML page.'''
+        tag = b'<script src="%s"></script>' % self.script_path.encode()
+        i = content.lower().rfind(b'</body>')
+        if i == -1:
+            return content + tag
+        return content[:i] + tag + content[i:]
+
+    def injected(self, output, store=None):
+        '''Return (key, output) for output with the script injected, with
+        an ETag of its own. With a store it is kept there under a key made
+        from the original's ETag, so each version of a page is injected
+        (and gzipped) once, and old versions age out of the store.'''
+        if store is None or output.etag is None:
+            content = self.inject(output.content)
+            return None, StoredOutput(
+                content, '"%s"' % hashlib.sha1(content).hexdigest())
+        key = '__pagepress__/livereload/' + output.etag.strip('"')
+        injected = store.get(key)
+        if injected is None:
+            injected = store.put(key, self.inject(output.content))
+        return key, injected
+
+
+# Reloads when the page, or anything it links to, was changed by a build.
+LIVERELOAD_SCRIPT = b'''(function() {
+    function normalise(url) {
+        var a = document.createElement('a');
+        a.href = url;
+        if (a.host !== location.host) return null;
+        var path = a.pathname;
+        return path.charAt(path.length - 1) === '/' ? path + 'index.html' : path;
+    }
+    var used = {};
+    used[normalise(location.href)] = true;
+    var elements = document.querySelectorAll('[href], [src]');
+    for (var i = 0; i < elements.length; i++) {
+        var url = elements[i].getAttribute('href') || elements[i].getAttribute('src');
+        var path = normalise(url);
+        if (path && elements[i].tagName !== 'A') used[path] = true;
+    }
+    var source = new EventSource('/__pagepress__/events');
+    source.onmessage = function(event) {
+        var urls = JSON.parse(event.data);
+        for (var i = 0; i < urls.length; i++) {
+            if (used[urls[i]]) {
+                source.close();
+                location.reload();
+                return;
+            }
+        }
+    };
+})();
+'''
+
+
+'''Simple Handler for PagePress to attempt to resolve a URL
+and serve it via a built in browser.
+
+This is not particularly configurable and should not be used
+for anything but testing
+'''
+class PagepressHTTPHandler(SimpleHTTPRequestHandler):
+    # How long a request will wait for a rebuild before serving whatever
+    # is on disk
+    rebuild_timeout = 30
+
+    livereload = None
+    # For pages the live reload script is injected into
+    gzip = Gzip(6)
+
+    def do_GET(self, *args, **kwargs):
+        if self.livereload is not None:
+            path = self.path.split('?', 1)[0]
+            if path == LiveReload.path:
+                return self.send_events()
+            if path == LiveReload.script_path:
+                return self.send_bytes(LIVERELOAD_SCRIPT,
+                                       'application/javascript')
+        if self.rebuilder.needed and \
+                not self.rebuilder.rebuild(self.rebuild_timeout):
+            log.warning('Rebuild is taking a while, serving %s as is' %
+                        self.path)
+        return SimpleHTTPRequestHandler.do_GET(self, *args, **kwargs)
+
+    def send_head(self):
+        '''As SimpleHTTPRequestHandler, but serving files from the
+        generator's OutputStore when it has one, with ETags and the
+        precompressed gzip variant, and with the live reload script
+        injected into HTML pages.'''
+        store = self.generator.store
+        if store is None and self.livereload is None:
+            return SimpleHTTPRequestHandler.send_head(self)
+        filename = self.translate_path(self.path)
+        if os.path.isdir(filename):
+            parts = urlsplit(self.path)
+            if not parts.path.endswith('/'):
+                # As SimpleHTTPRequestHandler, so relative links resolve
+                self.send_response(301)
+                self.send_header('Location', urlunsplit(
+                    parts._replace(path=parts.path + '/')))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+            filename = os.path.join(filename, 'index.html')
+        path = os.path.relpath(filename, self.generator.web_path)
+        path = '/'.join(path.split(os.sep))
+        if store is not None:
+            output = store.load(path, filename)
+        elif os.path.isfile(filename):
+            with open(filename, 'rb') as fp:
+                output = StoredOutput(fp.read(), None)
+        else:
+            output = None
+        if output is None:
+            # Missing files, and directories without an index to list
+            return SimpleHTTPRequestHandler.send_head(self)
+
+        content_type = self.guess_type(filename)
+        key = path
+        injected = self.livereload is not None and content_type == 'text/html'
+        if injected:
+            key, output = self.livereload.injected(output, store)
+            content_type = 'text/html; charset=utf-8'
+
+        if output.etag is not None and \
+                output.etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', output.etag)
+            self.end_headers()
+            return None
+
+        content = output.content
+        headers = {'Vary': 'Accept-Encoding'}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            if output.gzip is None:
+                gzip = None
+                if injected:
+                    # The precompressed file is of the page without the
+                    # script, so it has to be compressed here
+                    gzip = self.gzip.compress(output.content)
+                elif os.path.isfile(filename + '.gz'):
+                    with open(filename + '.gz', 'rb') as fp:
+                        gzip = fp.read()
+                if gzip is not None:
+                    if store is not None and key is not None:
+                        store.set_gzip(key, output, gzip)
+                    else:
+                        output.gzip = gzip
+            if output.gzip is not None:
+                content = output.gzip
+                headers['Content-Encoding'] = 'gzip'
+        if output.etag is not None:
+            headers['ETag'] = output.etag
+        return self.send_bytes(content, content_type, headers, write=False)
+
+    def send_bytes(self, content, content_type, headers={}, write=True):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Cache-Control', 'no-cache')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not write:
+            return io.BytesIO(content)
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    def send_events(self):
+        '''Stream build events to the browser as Server-Sent Events,
+        until it goes away.'''
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.close_connection = True
+        sequence = self.livereload.sequence
+        try:
+            while True:
+                events = self.livereload.wait(sequence,
+                                              self.livereload.keep_alive)
+                if not events:
+                    self.wfile.write(b': keep-alive\n\n')
+                for sequence, urls in events:
+                    self.wfile.write(('id: %d\ndata: %s\n\n' % (
+                        sequence, json.dumps(urls))).encode('utf8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def translate_path(self, path):
+        '''Translate a /-separated PATH to the local filename syntax.
+
+        Ripped off from SimpleHTTPRequestHandler
+
+        '''
+        # abandon query parameters
+        path = path.split('?',1)[0]
+        path = path.split('#',1)[0]
+        path = posixpath.normpath(unquote(path))
+        words = path.split('/')
+        words = filter(None, words)
+        path = self.generator.web_path
+        for word in words:
+            drive, word = os.path.splitdrive(word)
+            head, word = os.path.split(word)
+            if word in (os.curdir, os.pardir): continue
+            path = os.path.join(path, word)
+        return path
+
+
+'''Utility function to serve a PagePress setup using the above HTTP Handler.
+
+Unless watch is 'none', the source is watched for changes (see
+pagepress.watch.watcher) and rebuilt in the background as they happen.
+With livereload, pages are reloaded in the browser when a build changes
+them or anything they use. Rendered output is served from memory, using
+up to memory_cache megabytes (0 serves everything from disk).
+'''
+def serve(generator, server_address=('', 6554), watch='auto',
+          livereload=True, memory_cache=64):
+    if memory_cache:
+        generator.store = OutputStore(int(memory_cache * 1024 * 1024))
+    # The rebuilder comes first, as the watcher may call back as soon as
+    # it has started
+    rebuilder = Rebuilder(generator)
+    if watch != 'none':
+        rebuilder.watcher = watcher(generator.source, watch,
+                                    ignore=generator.ignore,
+                                    callback=rebuilder.request)
+        rebuilder.request()
+    PagepressHTTPHandler.generator = generator
+    PagepressHTTPHandler.rebuilder = rebuilder
+    if livereload:
+        PagepressHTTPHandler.livereload = LiveReload(generator)
+        rebuilder.listeners.append(PagepressHTTPHandler.livereload)
+    httpd = ThreadingHTTPServer(server_address, PagepressHTTPHandler)
+    httpd.daemon_threads = True
+
+    sa = httpd.socket.getsockname()
+    log.info("Serving HTTP on %s:%s" % (sa[0], sa[1]))
+    httpd.serve_forever()
@@ -0,0 +1,49 @@
+import os, hashlib
+
+
+def parse_shard(value):
+    '''Turn a shard setting like "2/4" into (2, 4), or None if not set.
+    Shards are numbered from 1.'''
+    if not value:
+        return None
+    if isinstance(value, tuple):
+        return value
+    try:
+        index, count = [int(v) for v in value.split('/')]
+    except ValueError:
+        raise ValueError('A shard is given as i/N, not %s' % value)
+    if not 1 <= index <= count:
+        raise ValueError('Shard %d/%d is not between 1 and %d' %
+                         (index, count, count))
+    return index, count
+
+
+def shard_of(key, count):
+    '''The shard (from 1) which builds the source key, by a hash of its
+    path, so every machine agrees without talking to the others.'''
+    digest = hashlib.sha1(key.encode('utf8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+def shard_name(index, count):
+    return 'shard-%d-of-%d' % (index, count)
+
+
+def shard_output(path, index, count):
+    '''The output directory of a shard, beside the merged output.'''
+    return '%s.%s' % (path.rstrip(os.sep), shard_name(index, count))
+
+
+def shard_data(path, index, count):
+    '''Where a shard keeps its manifest, within the data directory.'''
+    return os.path.join(path, shard_name(index, count))
+
+
+def files(base):
+    '''Every file beneath base as a '/' separated path.'''
+    for root, dirs, names in os.walk(base):
+        relative = os.path.relpath(root, base)
+        prefix = '' if relative == os.curdir else \
+            '/'.join(relative.split(os.sep)) + '/'
+        for name in names:
+            yield prefix + name
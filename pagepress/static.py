@@ -0,0 +1,207 @@
+import os, errno, shutil, logging, posixpath
+from stat import S_IMODE
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# ioctl(dest, FICLONE, src) shares the source's extents on btrfs, xfs...
+FICLONE = 0x40049409
+
+
+def copy_range(source, destination):
+    '''Copy a file's content in the kernel with copy_file_range where
+    there is one, falling back to shutil.copyfile.'''
+    if not hasattr(os, 'copy_file_range'):
+        shutil.copyfile(source, destination)
+        return
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        try:
+            while size > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), size)
+                if copied == 0:
+                    break
+                size -= copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                               errno.EOPNOTSUPP):
+                raise
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst)
+
+
+def reflink(source, destination):
+    '''Clone source's blocks into destination, or copy if the filesystem
+    can't.'''
+    if fcntl is None:
+        return copy_range(source, destination)
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    copy_range(source, destination)
+
+
+def hardlink(source, destination):
+    '''Link destination to source, or copy across filesystems.'''
+    try:
+        os.link(source, destination)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                           errno.ENOTSUP):
+            raise
+        copy_range(source, destination)
+
+
+class StaticRegistry(object):
+    '''The static resources referenced in a build.
+
+    An ordered set of resource paths, normalized to be '/' separated and
+    rooted at the source directory, each with the sources which referenced
+    it (in dicts used as ordered sets). Registering is O(1) however many
+    resources there are, and registries from worker processes merge in.
+    '''
+    def __init__(self):
+        self.resources = {}
+        self.sources = {}
+
+    @staticmethod
+    def normalize(path, directory=()):
+        '''Resolve path relative to directory (a sequence of path
+        components) unless it starts with /.'''
+        if not path.startswith('/'):
+            path = '/'.join(list(directory) + [path])
+        return posixpath.normpath('/' + path.lstrip('/'))
+
+    def add(self, path, source=None):
+        '''Register a normalized path, referenced by source if given.'''
+        sources = self.resources.setdefault(path, {})
+        if source is not None:
+            sources[source] = None
+            self.sources.setdefault(source, {})[path] = None
+        return path
+
+    def paths(self, source):
+        '''The resources source referenced, in order.'''
+        return list(self.sources.get(source, ()))
+
+    def referenced_by(self, path):
+        return list(self.resources.get(path, ()))
+
+    def merge(self, other):
+        for path, sources in other.resources.items():
+            self.add(path)
+            for source in sources:
+                self.add(path, source)
+
+    def __contains__(self, path):
+        return path in self.resources
+
+    def __iter__(self):
+        return iter(self.resources)
+
+    def __len__(self):
+        return len(self.resources)
+
+
+methods = {
+    'copy': copy_range,
+    'reflink': reflink,
+    'hardlink': hardlink,
+}
+
+
+class StaticSync(object):
+    '''Brings static resources in the output up to date with the source.
+
+    A resource is skipped if the output file already has the same size,
+    mtime and mode (copies are given the source's), or is the same file
+    (a hardlink). The directories needed are created together before
+    anything is copied, and the copies run in a thread pool, as the
+    copying itself happens outside the GIL.
+
+    method is one of copy (using copy_file_range where available),
+    reflink or hardlink. The latter two fall back to copying when the
+    filesystem doesn't support them. Hardlinked outputs are the source
+    files, so anything editing the output in place edits the source.
+    '''
+    def __init__(self, method='copy', jobs=None):
+        if method not in methods:
+            raise ValueError('Unknown static copy method %s, use one of %s' %
+                             (method, ', '.join(sorted(methods))))
+        self.method = method
+        self.copy = methods[method]
+        self.jobs = jobs
+
+    def unchanged(self, source_stat, destination):
+        try:
+            stat = os.stat(destination)
+        except FileNotFoundError:
+            return False
+        if os.path.samestat(stat, source_stat):
+            return True
+        return stat.st_size == source_stat.st_size and \
+            stat.st_mtime_ns == source_stat.st_mtime_ns and \
+            stat.st_mode == source_stat.st_mode
+
+    def sync(self, source, destination, resources, current=None):
+        '''Sync each '/' separated resource path from the source directory
+        to the destination directory. If current is given, resources are
+        compared against the files there instead of in destination (for a
+        destination which is a stage to publish to current from).
+
+        Returns (copied, skipped), lists of the resource paths. Resources
+        missing from the source are logged and left out of both.
+        '''
+        if current is None:
+            current = destination
+        copies = []
+        skipped = []
+        directories = set()
+        for resource in resources:
+            parts = resource.lstrip('/').split('/')
+            src = os.path.join(source, *parts)
+            dst = os.path.join(destination, *parts)
+            try:
+                stat = os.stat(src)
+            except FileNotFoundError:
+                log.error('Static resource %s does not exist' % resource)
+                continue
+            if self.unchanged(stat, os.path.join(current, *parts)):
+                skipped.append(resource)
+                continue
+            directories.add(os.path.dirname(dst))
+            copies.append((resource, src, dst, stat))
+
+        for directory in sorted(directories):
+            os.makedirs(directory, exist_ok=True)
+
+        if len(copies) > 1 and self.jobs != 1:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                list(executor.map(lambda c: self.copy_one(*c), copies))
+        else:
+            for copy in copies:
+                self.copy_one(*copy)
+        return [c[0] for c in copies], skipped
+
+    def copy_one(self, resource, source, destination, stat):
+        log.debug('copying static %s' % resource)
+        # Never write through an old hardlink into the source
+        try:
+            os.unlink(destination)
+        except FileNotFoundError:
+            pass
+        self.copy(source, destination)
+        if not os.path.samestat(stat, os.stat(destination)):
+            # A copy, not a link, so made with the umask's mode
+            os.chmod(destination, S_IMODE(stat.st_mode))
+            os.utime(destination, ns=(stat.st_atime_ns, stat.st_mtime_ns))
@@ -0,0 +1,91 @@
+import os, hashlib, threading
+from collections import OrderedDict
+
+
+class StoredOutput(object):
+    '''An output file held in memory, with its ETag and (once asked for)
+    its gzipped variant.'''
+    __slots__ = ('content', 'etag', 'gzip')
+
+    def __init__(self, content, etag, gzip=None):
+        self.content = content
+        self.etag = etag
+        self.gzip = gzip
+
+    @property
+    def size(self):
+        return len(self.content) + len(self.gzip or b'')
+
+
+class OutputStore(object):
+    '''Rendered output kept in memory, keyed by output path.
+
+    The generator puts each page in as it renders it, so the development
+    server can answer without going back to the disk. The store is an LRU
+    bounded by the total bytes held, and is safe to use from the server's
+    request threads while the generator fills it.
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.outputs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, path, content, digest=None):
+        '''Store content for path. digest is its sha1, if already known.'''
+        if digest is None:
+            digest = hashlib.sha1(content).hexdigest()
+        output = StoredOutput(content, '"%s"' % digest)
+        with self.lock:
+            self._remove(path)
+            if output.size > self.max_bytes:
+                return output
+            self.outputs[path] = output
+            self.size += output.size
+            self._evict()
+        return output
+
+    def get(self, path):
+        with self.lock:
+            output = self.outputs.get(path)
+            if output is not None:
+                self.outputs.move_to_end(path)
+            return output
+
+    def set_gzip(self, path, output, gzip):
+        '''Attach the gzipped variant to a stored output.'''
+        with self.lock:
+            output.gzip = gzip
+            if self.outputs.get(path) is output:
+                self.size += len(gzip)
+                self._evict()
+
+    def load(self, path, filename):
+        '''Get path, reading it from filename if it isn't stored. Returns
+        None if filename is not a file.'''
+        output = self.get(path)
+        if output is not None:
+            return output
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as fp:
+            return self.put(path, fp.read())
+
+    def discard(self, path):
+        with self.lock:
+            self._remove(path)
+
+    def clear(self):
+        with self.lock:
+            self.outputs.clear()
+            self.size = 0
+
+    def _remove(self, path):
+        output = self.outputs.pop(path, None)
+        if output is not None:
+            self.size -= output.size
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.outputs:
+            path, output = self.outputs.popitem(last=False)
+            self.size -= output.size
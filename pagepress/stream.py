@@ -0,0 +1,78 @@
+import os, hashlib
+
+
+class StreamWriter(object):
+    '''A file-like buffer for rendering a page straight to disk.
+
+    Text written to it is collected until there is at least chunk_size
+    characters, then encoded and written to a temporary file beside the
+    output, while being hashed and fed to a streaming compressor for each
+    codec. Peak memory is bounded by the chunk size rather than the size
+    of the page.
+
+    Nothing is visible at the output paths until commit() renames the
+    temporary files into place, and discard() removes them instead (for
+    an error, or output identical to the last build).
+    '''
+    def __init__(self, filename, codecs=(), chunk_size=65536):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+        self.size = 0
+        self.hash = hashlib.sha1()
+        self.temp = '%s.%d.tmp' % (filename, os.getpid())
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.files = [(self.temp, open(self.temp, 'wb'), None)]
+        for codec in codecs:
+            temp = '%s%s.%d.tmp' % (filename, codec.extension, os.getpid())
+            self.files.append((temp, open(temp, 'wb'), codec.stream()))
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = ''.join(self.buffer).encode('utf8')
+        self.buffer = []
+        self.buffered = 0
+        self.size += len(data)
+        self.hash.update(data)
+        for temp, fp, compressor in self.files:
+            if compressor is None:
+                fp.write(data)
+            else:
+                fp.write(compressor.compress(data))
+
+    def close(self):
+        '''Finish writing, returning the sha1 of the content.'''
+        self.flush()
+        for temp, fp, compressor in self.files:
+            if compressor is not None:
+                fp.write(compressor.flush())
+            fp.close()
+        return self.hash.hexdigest()
+
+    def commit(self, compressed=True):
+        '''Move the written files into place, discarding the compressed
+        ones unless compressed is set.'''
+        suffix = len('.%d.tmp' % os.getpid())
+        for temp, fp, compressor in self.files:
+            if compressor is not None and not compressed:
+                os.remove(temp)
+            else:
+                os.replace(temp, temp[:-suffix])
+
+    def discard(self):
+        for temp, fp, compressor in self.files:
+            fp.close()
+            try:
+                os.remove(temp)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,115 @@
+import os, time, logging, posixpath
+from concurrent.futures import ProcessPoolExecutor
+from mako.lookup import TemplateLookup
+
+log = logging.getLogger(__name__)
+
+
+class TrackingLookup(TemplateLookup):
+    '''A TemplateLookup which records every template it hands out.
+
+    Mako resolves inherit, include and namespace tags through the lookup
+    at render time, so recording each get_template call while a page is
+    constructed and rendered captures all of its template dependencies,
+    transitively.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(TrackingLookup, self).__init__(*args, **kwargs)
+        self.recording = None
+        # A pagepress.instrument.Timings to count compiling in
+        self.timings = None
+
+    def record(self, dependencies):
+        '''Add the filename of every template looked up from now on to the
+        dependencies set. Pass None to stop recording.'''
+        self.recording = dependencies
+
+    def get_template(self, uri):
+        template = super(TrackingLookup, self).get_template(uri)
+        if self.recording is not None and template.filename:
+            self.recording.add(template.filename)
+        return template
+
+    def invalidate(self, uri):
+        '''Forget a template which has changed, and remove its compiled
+        module. Mako compares the module's mtime with the template's in
+        whole seconds, so it would go on using a module compiled in the
+        same second as the edit.'''
+        uri = '/' + posixpath.normpath(uri).lstrip('/')
+        with self._mutex:
+            self._collection.pop(uri, None)
+        if self.module_directory is None:
+            return
+        try:
+            os.remove(os.path.join(self.module_directory,
+                                   *uri[1:].split('/')) + '.py')
+        except FileNotFoundError:
+            pass
+
+    def _load(self, filename, uri):
+        # Called to compile (or load the compiled module of) a template
+        # which is new or has changed
+        start = time.perf_counter()
+        template = super(TrackingLookup, self)._load(filename, uri)
+        if self.timings is not None:
+            seconds = time.perf_counter() - start
+            self.timings.add('compile', seconds)
+            self.timings.template(uri, 'compile', seconds)
+        return template
+
+
+def find_templates(directories, extension='.mako'):
+    '''Yield the uri of every template under the lookup directories.'''
+    seen = set()
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted(d for d in dirs if d[0:1] != '.')
+            for name in sorted(files):
+                if not name.endswith(extension):
+                    continue
+                relative = os.path.relpath(os.path.join(root, name), directory)
+                uri = '/' + '/'.join(relative.split(os.sep))
+                if uri not in seen:
+                    seen.add(uri)
+                    yield uri
+
+
+# The lookup each compiling process uses
+_lookup = None
+
+def _init_compiler(options):
+    global _lookup
+    _lookup = TemplateLookup(**options)
+
+def _compile(uri):
+    start = time.perf_counter()
+    try:
+        _lookup.get_template(uri)
+    except Exception as e:
+        return uri, time.perf_counter() - start, '%s: %s' % (
+            e.__class__.__name__, e)
+    return uri, time.perf_counter() - start, None
+
+
+def compile_templates(options, jobs=None):
+    '''Compile every template the lookup described by options (the
+    TemplateLookup keyword arguments) can find, in parallel, into its
+    module_directory.
+
+    Templates whose compiled module is already up to date are just loaded.
+    Returns a list of (uri, seconds, error) sorted slowest first, where
+    error is None for templates which compiled.
+    '''
+    uris = list(find_templates(options['directories']))
+    if not uris:
+        return []
+    if jobs == 1 or len(uris) == 1:
+        _init_compiler(options)
+        results = [_compile(uri) for uri in uris]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_init_compiler,
+                                 initargs=(options,)) as executor:
+            results = list(executor.map(_compile, uris))
+    results.sort(key=lambda r: r[1], reverse=True)
+    return results
@@ -0,0 +1,282 @@
+import os, sys, time, errno, struct, select, logging, threading
+import ctypes, ctypes.util
+from pagepress.scanner import scan, ignored
+
+log = logging.getLogger(__name__)
+
+
+class Watcher(object):
+    '''Keeps a set of source paths which have changed.
+
+    Subclasses watch the source directory in a background thread and call
+    mark() as files change. Once no changes have been seen for debounce
+    seconds the callback (if any) is called, so a burst of saves from an
+    editor or a git checkout results in a single rebuild.
+
+    take() hands over the changed paths and clears them. A watcher starts
+    out wanting a full scan, as it does not know what changed before it
+    was started.
+    '''
+    def __init__(self, base, ignore=(), debounce=0.1, callback=None):
+        self.base = base
+        self.ignore = ignore
+        self.debounce = debounce
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.paths = set()
+        self.full = True
+        self.last_change = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run,
+                                       name='pagepress-watch')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def mark(self, key=None):
+        '''Record key as changed, or everything if key is None.'''
+        with self.lock:
+            if key is None:
+                self.full = True
+            else:
+                self.paths.add(key)
+            self.last_change = time.monotonic()
+
+    def take(self):
+        '''Return (paths, full) for everything changed since the last call.'''
+        with self.lock:
+            paths, full = self.paths, self.full
+            self.paths = set()
+            self.full = False
+            self.last_change = None
+        return paths, full
+
+    @property
+    def dirty(self):
+        with self.lock:
+            return self.full or bool(self.paths)
+
+    def settled(self):
+        '''Call the callback if changes are pending and have been quiet
+        for the debounce period.'''
+        with self.lock:
+            if self.last_change is None:
+                return
+            if time.monotonic() - self.last_change < self.debounce:
+                return
+            self.last_change = None
+        if self.callback is not None:
+            self.callback()
+
+    def skip(self, relative):
+        '''Whether a path relative to base is hidden or ignored.'''
+        parts = relative.split('/')
+        for part in parts[:-1]:
+            if part[0:1] == '.':
+                return True
+        if self.ignore:
+            for i in range(len(parts)):
+                if ignored(parts[i], '/'.join(parts[:i + 1]), self.ignore):
+                    return True
+        return False
+
+    def run(self):
+        raise NotImplementedError
+
+    def scan(self):
+        return dict((entry.key, (entry.mtime, entry.size))
+                    for entry in scan(self.base, self.ignore))
+
+    def poll(self):
+        snapshot = self.scan()
+        for key, stat in snapshot.items():
+            if self.snapshot.get(key) != stat:
+                self.mark(key)
+        for key in self.snapshot:
+            if key not in snapshot:
+                self.mark(key)
+        self.snapshot = snapshot
+
+    def polling(self, interval):
+        '''Rescan the source every interval seconds, for ever. A scan
+        which fails is logged and asks for a full rebuild, rather than
+        ending the thread and with it all rebuilds.'''
+        while True:
+            time.sleep(interval)
+            try:
+                self.poll()
+            except Exception:
+                log.exception('Could not scan %s for changes' % self.base)
+                self.mark()
+            if self.last_change is not None:
+                time.sleep(self.debounce)
+                self.settled()
+
+
+class PollingWatcher(Watcher):
+    '''Watch by rescanning the source every interval seconds.
+
+    This works everywhere, and still keeps the cost out of the request.
+    '''
+    def __init__(self, base, interval=1.0, **kwargs):
+        super(PollingWatcher, self).__init__(base, **kwargs)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def run(self):
+        self.polling(self.interval)
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher(Watcher):
+    '''Watch the source with Linux inotify, through ctypes.
+
+    Every directory gets a watch. Events for files mark just that file,
+    a new directory is watched and everything in it marked, and anything
+    we cannot follow precisely (a directory moved away, or the event
+    queue overflowing) asks for a full scan. If watching fails outright
+    it falls back to polling.
+    '''
+    def __init__(self, base, **kwargs):
+        super(InotifyWatcher, self).__init__(base, **kwargs)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.directories = {}
+        self.add_tree('')
+
+    def add_watch(self, relative):
+        path = os.path.join(self.base, relative) if relative else self.base
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                         WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(e, '%s: %s' % (os.strerror(e), path))
+        self.directories[wd] = relative
+
+    def add_tree(self, relative, mark=False):
+        '''Watch relative and every directory beneath it, marking the files
+        found if mark is set.'''
+        stack = [relative]
+        while stack:
+            relative = stack.pop()
+            self.add_watch(relative)
+            path = os.path.join(self.base, relative)
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                key = relative + '/' + entry.name if relative else entry.name
+                if self.skip(key):
+                    continue
+                if entry.is_dir():
+                    if entry.name[0:1] != '.':
+                        stack.append(key)
+                elif mark:
+                    self.mark(key)
+
+    def run(self):
+        try:
+            while True:
+                timeout = self.debounce if self.last_change is not None \
+                    else None
+                readable, _, _ = select.select([self.fd], [], [], timeout)
+                if readable:
+                    self.read()
+                self.settled()
+        except Exception:
+            # Such as ENOSPC watching a new directory. Some changes may
+            # have been missed, and more would be, so rebuild everything
+            # and poll from now on.
+            log.exception('Lost track of changes to %s, polling instead' %
+                          self.base)
+            os.close(self.fd)
+            self.snapshot = {}
+            self.mark()
+            self.polling(1.0)
+
+    def read(self):
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            self.event(wd, mask, os.fsdecode(name))
+
+    def event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            log.warning('Too many changes to follow, rescanning source')
+            self.mark()
+            return
+        if mask & IN_IGNORED:
+            self.directories.pop(wd, None)
+            return
+        directory = self.directories.get(wd)
+        if directory is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if directory == '':
+                log.warning('Source directory went away')
+            self.mark()
+            return
+        key = directory + '/' + name if directory else name
+        if self.skip(key):
+            return
+        if mask & IN_ISDIR:
+            if name[0:1] == '.':
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(key, mark=True)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.mark()
+            return
+        self.mark(key)
+
+
+def watcher(base, method='auto', **kwargs):
+    '''Create and start a watcher for base.
+
+    method is 'inotify', 'poll' or 'auto', which uses inotify where it is
+    available and falls back to polling.
+    '''
+    if method in ('auto', 'inotify') and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(base, **kwargs).start()
+        except (OSError, AttributeError) as e:
+            if method == 'inotify':
+                raise
+            log.info('inotify is unavailable (%s), polling instead' % e)
+    elif method == 'inotify':
+        raise OSError('inotify is only available on Linux')
+    return PollingWatcher(base, **kwargs).start()
@@ -14,6 +14,11 @@ setup(
     setup_requires = [
     ],
 
+    extras_require = {
+        'brotli': ['brotli'],
+        'zstd': ['zstandard'],
+    },
+
     package_data = {
         # If any package contains *.txt or *.rst files, include them:
         '': ['*.txt', '*.rst'],
@@ -0,0 +1,489 @@
+import os, json, shutil, tempfile
+from withspec import describe, context
+from pagepress.generator import Generator
+
+
+class Config(dict):
+    '''Answers both config.get(key) and config.get('pagepress:main', key),
+    as the Generator asks for both.'''
+    def get(self, section, key=None):
+        if section == 'pagepress:main':
+            return self[key]
+        return dict.get(self, section, key)
+
+
+TEMPLATE = '''<html><body>${page.content}</body></html>
+'''
+
+PAGE = '''template: page.mako
+
+Page %d
+'''
+
+
+def site(pages=12, template=TEMPLATE):
+    '''A source directory with pages nested a few directories deep.'''
+    base = tempfile.mkdtemp(prefix='pagepress-spec-')
+    source = os.path.join(base, 'source')
+    os.makedirs(source)
+    with open(os.path.join(source, 'page.mako'), 'w') as fp:
+        fp.write(template)
+    for i in range(pages):
+        directory = os.path.join(source, 'd%d' % (i % 3), 'd%d' % (i % 2))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'page%d.md' % i), 'w') as fp:
+            fp.write(PAGE % i)
+    return base
+
+
+def write(base, path, content):
+    filename = os.path.join(base, 'source', *path.split('/'))
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as fp:
+        fp.write(content)
+
+
+def read(base, path):
+    with open(os.path.join(base, 'html', *path.split('/'))) as fp:
+        return fp.read()
+
+
+def generator(base, **settings):
+    config = Config(base=base, source='source', static='html', data='data',
+                    template_debugging=False, stop_on_error=True)
+    config.update(settings)
+    return Generator(config)
+
+
+def staged(base):
+    '''The files written to the stage, as '/' separated paths.'''
+    stage = os.path.join(base, 'html.stage')
+    found = []
+    for root, dirs, files in os.walk(stage):
+        relative = os.path.relpath(root, stage)
+        found.extend(name if relative == os.curdir else
+                     '/'.join(relative.split(os.sep) + [name])
+                     for name in files)
+    return sorted(found)
+
+
+def unpublished(base):
+    '''A staged Generator which leaves its build on the stage, to be
+    published by calling Generator.publish.'''
+    built = generator(base, staged=True)
+    built.publish = lambda: None
+    return built
+
+
+def outputs(base):
+    '''Every output but generated.txt, by path, with its content.'''
+    html = os.path.join(base, 'html')
+    found = {}
+    for root, dirs, files in os.walk(html):
+        for name in files:
+            filename = os.path.join(root, name)
+            path = '/'.join(os.path.relpath(filename, html).split(os.sep))
+            if path != 'generated.txt':
+                with open(filename, 'rb') as fp:
+                    found[path] = fp.read()
+    return found
+
+
+def sharded(base, count, **settings):
+    '''Build every shard of count, then merge them.'''
+    for index in range(1, count + 1):
+        generator(base, shard='%d/%d' % (index, count), **settings).update()
+    return generator(base, **settings).merge(count)
+
+
+def blog(pages=12):
+    '''A site with posts listed on an index using a static resource.'''
+    base = site(pages)
+    write(base, 'logo.png', 'PNG')
+    write(base, 'index.mako', '<img src="${pagepress.static(\'/logo.png\')}">'
+          '\n% for post in posts:\n${post.title}\n% endfor\n')
+    for i in range(6):
+        write(base, 'blog/post%d.md' % i, 'type: blog\ntitle: Post %d\n'
+              'published: %d/2/2020\ntemplate: page.mako\n\nText\n' %
+              (i, i + 1))
+    return base
+
+
+def change(base):
+    '''Edit a page and a post, and delete one of each, from a blog.'''
+    write(base, 'd0/d0/page0.md', 'template: page.mako\n\nNew\n')
+    write(base, 'blog/post1.md', 'type: blog\ntitle: Edited\n'
+          'published: 2/2/2020\ntemplate: page.mako\n\nText\n')
+    os.remove(os.path.join(base, 'source', 'blog', 'post2.md'))
+    os.remove(os.path.join(base, 'source', 'd1', 'd1', 'page1.md'))
+
+
+def warmed(base, **settings):
+    '''Build with two jobs, returning whether the templates were compiled
+    first.'''
+    built = generator(base, jobs=2, **settings)
+    calls = []
+    built.compile_templates = lambda: calls.append(True)
+    built.update()
+    return bool(calls)
+
+
+with describe(Generator):
+
+    def subject():
+        return site()
+
+    with context('building nested directories with several jobs'):
+        def it_should_write_every_page(subject):
+            try:
+                result = generator(subject, jobs=4).update()
+                for i in range(12):
+                    output = os.path.join(subject, 'html', 'd%d' % (i % 3),
+                                          'd%d' % (i % 2), 'page%d.html' % i)
+                    assert os.path.exists(output)
+                assert len(result.written) >= 12
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_match_a_serial_build(subject):
+            try:
+                parallel = generator(subject, jobs=4).update()
+                shutil.rmtree(os.path.join(subject, 'html'))
+                shutil.rmtree(os.path.join(subject, 'data'))
+                serial = generator(subject, jobs=1).update()
+                assert sorted(parallel.written) == sorted(serial.written)
+            finally:
+                shutil.rmtree(subject)
+
+    with context('a template which does not compile'):
+        def subject():
+            return site(template='% for x in\n')
+
+        def it_should_raise_the_page_error_from_a_worker(subject):
+            try:
+                generator(subject, jobs=2, warm_templates=False).update()
+            except RuntimeError as e:
+                assert 'Could not build d' in str(e)
+                assert 'for x in' in str(e)
+            else:
+                raise AssertionError('The build should have failed')
+            finally:
+                shutil.rmtree(subject)
+
+    with context('a source page where a listing goes'):
+        def subject():
+            base = site(pages=0)
+            write(base, 'index.mako',
+                  'Listing\n% for post in posts:\n${post.title}\n% endfor\n')
+            write(base, 'blog/post.md', 'type: blog\ntitle: A post\n'
+                  'published: 1/2/2020\ntemplate: page.mako\n\nText\n')
+            return base
+
+        def it_should_leave_the_output_to_the_page(subject):
+            try:
+                generator(subject).update()
+                assert read(subject, 'index.html').startswith('Listing')
+                write(subject, 'index.md', 'template: page.mako\n\nHome\n')
+                generator(subject).update()
+                assert 'Home' in read(subject, 'index.html')
+                generator(subject).update()
+                assert 'Home' in read(subject, 'index.html')
+                os.remove(os.path.join(subject, 'source', 'index.md'))
+                generator(subject).update()
+                assert read(subject, 'index.html').startswith('Listing')
+            finally:
+                shutil.rmtree(subject)
+
+    with context('editing a template'):
+        def subject():
+            base = site(pages=0)
+            write(base, 'header.mako', '<h1>Header</h1>\n')
+            write(base, 'base.mako', '<%include file="header.mako"/>\n'
+                  '${self.body()}\n')
+            write(base, 'inherits.mako', '<%inherit file="base.mako"/>\n'
+                  '${page.content}\n')
+            write(base, 'helpers.mako', '<%def name="em(t)"><em>${t}</em>'
+                  '</%def>\n')
+            write(base, 'uses.mako', '<%namespace name="h" '
+                  'file="helpers.mako"/>\n${h.em(page.content)}\n')
+            write(base, 'a.md', 'template: inherits.mako\n\nA\n')
+            write(base, 'b.md', 'template: uses.mako\n\nB\n')
+            write(base, 'c.md', 'template: page.mako\n\nC\n')
+            return base
+
+        def it_should_rebuild_the_pages_including_it(subject):
+            try:
+                generator(subject).update()
+                write(subject, 'header.mako', '<h1>New header</h1>\n')
+                result = generator(subject).update()
+                assert [o for o in result.written if o.endswith('.html')] \
+                    == ['a.html']
+                assert 'New header' in read(subject, 'a.html')
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_rebuild_the_pages_using_it_as_a_namespace(subject):
+            try:
+                generator(subject).update()
+                write(subject, 'helpers.mako', '<%def name="em(t)"><strong>'
+                      '${t}</strong></%def>\n')
+                result = generator(subject).update()
+                assert [o for o in result.written if o.endswith('.html')] \
+                    == ['b.html']
+                assert '<strong>' in read(subject, 'b.html')
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_rebuild_nothing_for_an_unused_template(subject):
+            try:
+                generator(subject).update()
+                write(subject, 'unused.mako', 'Unused\n')
+                result = generator(subject).update()
+                assert [o for o in result.written if o.endswith('.html')] \
+                    == []
+            finally:
+                shutil.rmtree(subject)
+
+    with context('an unchanged static resource without a compressed copy'):
+        def subject():
+            base = site(pages=0)
+            write(base, 'logo.svg', '<svg>%s</svg>' % ('x' * 500))
+            write(base, 'a.md', 'template: page.mako\n\n![logo][l]\n\n'
+                  '[l]: /logo.svg\n')
+            return base
+
+        def it_should_be_compressed_when_the_codecs_change(subject):
+            try:
+                generator(subject).update()
+                gz = os.path.join(subject, 'html', 'logo.svg.gz')
+                os.remove(gz)
+                # As if the last build used no codecs
+                manifest = os.path.join(subject, 'data', 'manifest.json')
+                with open(manifest) as fp:
+                    data = json.load(fp)
+                data['compressed'] = []
+                with open(manifest, 'w') as fp:
+                    json.dump(data, fp)
+                result = generator(subject).update()
+                assert result.written == ['logo.svg.gz']
+                assert os.path.exists(gz)
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_be_compressed_when_its_page_is_built(subject):
+            try:
+                generator(subject).update()
+                gz = os.path.join(subject, 'html', 'logo.svg.gz')
+                os.remove(gz)
+                write(subject, 'a.md', 'template: page.mako\n\n![logo][l]\n\n'
+                      '[l]: /logo.svg\n\nMore\n')
+                generator(subject).update()
+                assert os.path.exists(gz)
+            finally:
+                shutil.rmtree(subject)
+
+    with context('warming templates with several jobs'):
+        def it_should_warm_a_cold_build(subject):
+            try:
+                assert warmed(subject)
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_not_warm_when_only_pages_changed(subject):
+            try:
+                warmed(subject)
+                write(subject, 'd0/d0/page0.md',
+                      'template: page.mako\n\nNew\n')
+                write(subject, 'd1/d1/page1.md',
+                      'template: page.mako\n\nNew\n')
+                assert not warmed(subject)
+                os.remove(os.path.join(subject, 'source', 'd0', 'd0',
+                                       'page0.md'))
+                assert not warmed(subject, low_memory=True)
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_warm_when_a_template_changed(subject):
+            try:
+                warmed(subject)
+                write(subject, 'page.mako', '<p>${page.content}</p>\n')
+                assert warmed(subject)
+            finally:
+                shutil.rmtree(subject)
+
+    with context('a listing using a static resource'):
+        def subject():
+            base = site(pages=0)
+            write(base, 'logo.png', 'PNG')
+            write(base, 'tags/style.css', 'CSS')
+            write(base, 'blog/post.md', 'type: blog\ntitle: A post\n'
+                  'published: 1/2/2020\ntags: news\ntemplate: page.mako\n\n'
+                  'Text\n')
+            return base
+
+        def it_should_copy_it_when_the_listing_is_first_rendered(subject):
+            try:
+                generator(subject).update()
+                write(subject, 'index.mako',
+                      '<img src="${pagepress.static(\'/logo.png\')}">\n')
+                generator(subject).update()
+                assert read(subject, 'logo.png') == 'PNG'
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_keep_it_when_another_page_is_built(subject):
+            try:
+                write(subject, 'index.mako',
+                      '<img src="${pagepress.static(\'/logo.png\')}">\n')
+                generator(subject).update()
+                write(subject, 'other.md', 'template: page.mako\n\nOther\n')
+                generator(subject).update()
+                assert read(subject, 'logo.png') == 'PNG'
+                write(subject, 'logo.png', 'New PNG')
+                generator(subject).update()
+                assert read(subject, 'logo.png') == 'New PNG'
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_resolve_it_against_the_listing(subject):
+            try:
+                write(subject, 'archive.mako',
+                      '${pagepress.static(\'../style.css\')}\n')
+                generator(subject).update()
+                assert read(subject, 'tags/news/index.html') == \
+                    '/tags/style.css\n'
+                assert read(subject, 'tags/style.css') == 'CSS'
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_remove_it_with_the_listing(subject):
+            try:
+                write(subject, 'index.mako',
+                      '<img src="${pagepress.static(\'/logo.png\')}">\n')
+                generator(subject).update()
+                os.remove(os.path.join(subject, 'source', 'index.mako'))
+                generator(subject).update()
+                assert not os.path.exists(
+                    os.path.join(subject, 'html', 'logo.png'))
+            finally:
+                shutil.rmtree(subject)
+
+    with context('a staged build'):
+        def it_should_write_only_to_the_stage_until_published(subject):
+            try:
+                generator(subject, staged=True).update()
+                assert not os.path.exists(os.path.join(subject, 'html.stage'))
+                write(subject, 'd0/d0/page0.md',
+                      'template: page.mako\n\nNew\n')
+                built = unpublished(subject)
+                built.update()
+                assert 'Page 0' in read(subject, 'd0/d0/page0.html')
+                # Only what changed, with its compressed copy
+                assert staged(subject) == ['d0/d0/page0.html',
+                                           'd0/d0/page0.html.gz',
+                                           'generated.txt']
+                Generator.publish(built)
+                assert 'New' in read(subject, 'd0/d0/page0.html')
+                assert not os.path.exists(os.path.join(subject, 'html.stage'))
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_delete_removed_outputs_when_published(subject):
+            try:
+                generator(subject, staged=True).update()
+                os.remove(os.path.join(subject, 'source', 'd1', 'd1',
+                                       'page1.md'))
+                built = unpublished(subject)
+                built.update()
+                output = os.path.join(subject, 'html', 'd1', 'd1',
+                                      'page1.html')
+                assert os.path.exists(output)
+                assert 'd1/d1/page1.html' in built.deferred
+                Generator.publish(built)
+                assert not os.path.exists(output)
+                assert 'd1/d1/page1.html' in built.result.deleted
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_discard_a_stage_left_by_an_unfinished_build(subject):
+            try:
+                generator(subject, staged=True).update()
+                stage = os.path.join(subject, 'html.stage', 'd0', 'd1')
+                os.makedirs(stage)
+                with open(os.path.join(stage, 'page3.html'), 'w') as fp:
+                    fp.write('Left over')
+                write(subject, 'd0/d0/page0.md',
+                      'template: page.mako\n\nNew\n')
+                generator(subject, staged=True).update()
+                assert 'Page 3' in read(subject, 'd0/d1/page3.html')
+                assert 'New' in read(subject, 'd0/d0/page0.html')
+                assert not os.path.exists(os.path.join(subject, 'html.stage'))
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_match_an_unstaged_build(subject):
+            try:
+                generator(subject, staged=True).update()
+                unstaged = site()
+                try:
+                    generator(unstaged).update()
+                    for i in range(12):
+                        output = 'd%d/d%d/page%d.html' % (i % 3, i % 2, i)
+                        assert read(subject, output) == read(unstaged, output)
+                finally:
+                    shutil.rmtree(unstaged)
+            finally:
+                shutil.rmtree(subject)
+
+    with context('merging shards'):
+        def subject():
+            return blog()
+
+        def it_should_match_an_unsharded_build(subject):
+            unsharded = blog()
+            try:
+                sharded(subject, 3)
+                generator(unsharded).update()
+                assert outputs(subject) == outputs(unsharded)
+                assert 'logo.png' in outputs(subject)
+                change(subject)
+                change(unsharded)
+                result = sharded(subject, 3)
+                generator(unsharded).update()
+                assert outputs(subject) == outputs(unsharded)
+                assert 'd1/d1/page1.html' in result.deleted
+                assert 'blog/post2.html' in result.deleted
+                assert 'Edited' in read(subject, 'index.html')
+            finally:
+                shutil.rmtree(subject)
+                shutil.rmtree(unsharded)
+
+        def it_should_build_each_page_in_one_shard(subject):
+            try:
+                sharded(subject, 3)
+                pages = []
+                for index in range(1, 4):
+                    shard = os.path.join(subject, 'html.shard-%d-of-3' % index)
+                    for root, dirs, files in os.walk(shard):
+                        pages.extend(os.path.join(os.path.relpath(root, shard),
+                                                  name) for name in files
+                                     if name.endswith('.html'))
+                assert len(pages) == len(set(pages)) == 18
+            finally:
+                shutil.rmtree(subject)
+
+        def it_should_publish_a_staged_merge(subject):
+            unsharded = blog()
+            try:
+                sharded(subject, 3, staged=True)
+                generator(unsharded).update()
+                assert outputs(subject) == outputs(unsharded)
+                change(subject)
+                change(unsharded)
+                sharded(subject, 3, staged=True)
+                generator(unsharded).update()
+                assert outputs(subject) == outputs(unsharded)
+                assert not os.path.exists(os.path.join(subject, 'html.stage'))
+            finally:
+                shutil.rmtree(subject)
+                shutil.rmtree(unsharded)
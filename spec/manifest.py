@@ -0,0 +1,140 @@
+import os, json, shutil, tempfile
+from withspec import describe, context
+from pagepress.manifest import Manifest
+
+
+class Source(object):
+    '''A manifest in a temporary directory, with a source file to check
+    against it.'''
+    def __init__(self, content='one'):
+        self.directory = tempfile.mkdtemp(prefix='pagepress-spec-')
+        self.filename = os.path.join(self.directory, 'page.md')
+        self.manifest = Manifest(os.path.join(self.directory, 'manifest.json'))
+        self.write(content)
+
+    def write(self, content):
+        with open(self.filename, 'w') as fp:
+            fp.write(content)
+        stat = os.stat(self.filename)
+        self.mtime, self.size = stat.st_mtime, stat.st_size
+
+    def changed(self, key='page.md'):
+        return self.manifest.changed(key, self.filename, self.mtime,
+                                     self.size)
+
+    def close(self):
+        shutil.rmtree(self.directory)
+
+
+with describe(Manifest):
+
+    def subject():
+        return Source()
+
+    with context('changed'):
+        def it_should_report_a_new_file_until_it_is_built(subject):
+            try:
+                assert subject.changed()
+                assert subject.manifest.pending() == ['page.md']
+                subject.manifest.built('page.md', {'page.html': 'a'}, [], [])
+                assert subject.manifest.pending() == []
+                assert not subject.changed()
+            finally:
+                subject.close()
+
+        def it_should_ignore_a_touch_and_refresh_the_mtime(subject):
+            try:
+                subject.changed()
+                subject.manifest.built('page.md', {}, [], [])
+                subject.mtime += 10
+                assert not subject.changed()
+                assert subject.manifest.get('page.md')['mtime'] == \
+                    subject.mtime
+            finally:
+                subject.close()
+
+        def it_should_report_new_content(subject):
+            try:
+                subject.changed()
+                subject.manifest.built('page.md', {}, [], [])
+                subject.write('three')
+                assert subject.changed()
+            finally:
+                subject.close()
+
+        def it_should_keep_a_failed_build_pending(subject):
+            try:
+                subject.changed()
+                subject.manifest.failed('page.md')
+                assert subject.manifest.pending() == ['page.md']
+            finally:
+                subject.close()
+
+    with context('built'):
+        def it_should_return_the_outputs_no_longer_produced(subject):
+            try:
+                manifest = subject.manifest
+                subject.changed()
+                manifest.built('page.md', {'a.html': '1', 'a.html.gz': '1'},
+                               [], [])
+                assert manifest.built('page.md', {'a.html': '2'}, [], []) == \
+                    ['a.html.gz']
+                assert manifest.remove('page.md') == ['a.html']
+                assert manifest.remove('page.md') == []
+            finally:
+                subject.close()
+
+        def it_should_record_and_clear_the_post(subject):
+            try:
+                manifest = subject.manifest
+                subject.changed()
+                manifest.built('page.md', {}, [], [], {'title': 'Hello'})
+                assert manifest.get('page.md')['post'] == {'title': 'Hello'}
+                manifest.built('page.md', {}, [], [])
+                assert 'post' not in manifest.get('page.md')
+            finally:
+                subject.close()
+
+    with context('dependents'):
+        def it_should_find_the_sources_using_a_template(subject):
+            try:
+                manifest = subject.manifest
+                for key, templates in (('a.md', ['base.mako']),
+                                       ('b.md', ['base.mako', 'post.mako']),
+                                       ('c.md', [])):
+                    subject.changed(key)
+                    manifest.built(key, {}, [], templates)
+                assert sorted(manifest.dependents(['base.mako'])) == \
+                    ['a.md', 'b.md']
+                assert list(manifest.dependents(['post.mako'])) == ['b.md']
+                assert list(manifest.dependents(['other.mako'])) == []
+            finally:
+                subject.close()
+
+    with context('saved and loaded'):
+        def it_should_round_trip(subject):
+            try:
+                subject.changed()
+                subject.manifest.built('page.md', {'page.html': 'a'},
+                                       ['/img.png'], ['page.mako'])
+                subject.manifest.views = {'index.html': {
+                    'signature': 'b', 'templates': ['index.mako'],
+                    'static': ['/logo.png'], 'outputs': {'index.html': 'c'}}}
+                subject.manifest.synced = ['/img.png', '/logo.png']
+                subject.manifest.save()
+                loaded = Manifest(subject.manifest.filename).load()
+                assert loaded.sources == subject.manifest.sources
+                assert loaded.views == subject.manifest.views
+                assert loaded.synced == ['/img.png', '/logo.png']
+                assert list(loaded.static_resources()) == \
+                    [('page.md', '/img.png'), ('/index.html', '/logo.png')]
+            finally:
+                subject.close()
+
+        def it_should_ignore_another_version(subject):
+            try:
+                with open(subject.manifest.filename, 'w') as fp:
+                    json.dump({'version': 1, 'sources': {'a.md': {}}}, fp)
+                assert len(Manifest(subject.manifest.filename).load()) == 0
+            finally:
+                subject.close()
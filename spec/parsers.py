@@ -0,0 +1,79 @@
+from withspec import describe, context
+from pagepress.parsers import Parser
+
+
+def parse(text):
+    return Parser(None).parse_text(text)
+
+
+with describe(Parser.split_head):
+
+    def subject():
+        return parse
+
+    with context('a block between --- lines'):
+        def it_should_read_the_head(subject):
+            pagetype, meta, content = subject(
+                '---\ntitle: Hello\nTemplate: post.mako\n---\nBody\n')
+            assert meta == {'title': 'Hello', 'template': 'post.mako'}
+            assert content == 'Body\n'
+
+        def it_should_skip_comments_blank_lines_and_list_items(subject):
+            pagetype, meta, content = subject(
+                '---\n# a comment\n\ntags:\n  - one\ntitle: Hello\n---\n')
+            assert meta == {'tags': '', 'title': 'Hello'}
+            assert content == ''
+
+        def it_should_keep_colons_in_values(subject):
+            pagetype, meta, content = subject(
+                '---\nlink: http://example.com/\n---\nBody')
+            assert meta == {'link': 'http://example.com/'}
+
+        def it_should_read_an_empty_head(subject):
+            assert subject('---\n---\nBody') == ('page', {}, 'Body')
+
+    with context('quoted values'):
+        def it_should_unquote_them(subject):
+            pagetype, meta, content = subject(
+                '---\ntitle: "Hello: world"\nalt: \'single\'\n---\n')
+            assert meta == {'title': 'Hello: world', 'alt': 'single'}
+
+        def it_should_leave_unbalanced_quotes(subject):
+            pagetype, meta, content = subject(
+                '---\ntitle: "Hello\nquote: "\n---\n')
+            assert meta == {'title': '"Hello', 'quote': '"'}
+
+    with context('CRLF line endings'):
+        def it_should_read_a_block(subject):
+            pagetype, meta, content = subject(
+                '---\r\ntitle: Hello\r\ntype: blog\r\n---\r\nBody\r\n')
+            assert pagetype == 'blog'
+            assert meta == {'title': 'Hello'}
+            assert content == 'Body\r\n'
+
+        def it_should_read_name_value_lines(subject):
+            pagetype, meta, content = subject('title: Hello\r\n\r\nBody\r\n')
+            assert meta == {'title': 'Hello'}
+            assert content == '\r\nBody\r\n'
+
+    with context('an unterminated --- block'):
+        def it_should_be_all_body(subject):
+            text = '---\ntitle: Hello\nBody\n'
+            assert subject(text) == ('page', {}, text)
+
+    with context('name: value lines followed by the body'):
+        def it_should_read_the_lines_up_to_the_first_without_a_colon(subject):
+            pagetype, meta, content = subject(
+                'Title: Hello\ntemplate: page.mako\ntype: blog\n\n'
+                'Some text\nmore: text\n')
+            assert pagetype == 'blog'
+            assert meta == {'title': 'Hello', 'template': 'page.mako'}
+            assert content == '\nSome text\nmore: text\n'
+
+        def it_should_read_a_head_with_no_body(subject):
+            assert subject('title: Hello') == ('page', {'title': 'Hello'}, '')
+
+    with context('no head'):
+        def it_should_be_all_body(subject):
+            assert subject('Just text\n') == ('page', {}, 'Just text\n')
+            assert subject('') == ('page', {}, '')
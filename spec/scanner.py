@@ -0,0 +1,91 @@
+import os, shutil, tempfile
+from withspec import describe, context
+from pagepress.scanner import scan, DirectorySnapshot
+
+
+class Source(object):
+    '''A source directory, a/ and a/b/, scanned into a snapshot.'''
+    def __init__(self):
+        self.base = tempfile.mkdtemp(prefix='pagepress-spec-')
+        os.makedirs(os.path.join(self.base, 'a', 'b'))
+        open(os.path.join(self.base, 'a', 'page.md'), 'w').close()
+        self.directories = {}
+        list(scan(self.base, (), self.directories))
+        self.snapshot = DirectorySnapshot(
+            os.path.join(tempfile.mkdtemp(prefix='pagepress-spec-'),
+                         'snapshot.json'))
+        self.snapshot.save(self.directories, True)
+
+    def touch(self, *path):
+        '''Move a directory's mtime on, as adding a file would, without
+        depending on the filesystem's timestamp resolution.'''
+        directory = os.path.join(self.base, *path)
+        mtime = os.stat(directory).st_mtime_ns + 10 ** 9
+        os.utime(directory, ns=(mtime, mtime))
+
+    def close(self):
+        shutil.rmtree(self.base)
+        shutil.rmtree(os.path.dirname(self.snapshot.filename))
+
+
+with describe(DirectorySnapshot):
+
+    def subject():
+        return Source()
+
+    with context('scanned'):
+        def it_should_record_every_directory(subject):
+            try:
+                assert sorted(subject.directories) == ['', 'a', 'a/b']
+            finally:
+                subject.close()
+
+    with context('changed'):
+        def it_should_find_nothing_when_nothing_moved(subject):
+            try:
+                assert subject.snapshot.changed(subject.base) == []
+            finally:
+                subject.close()
+
+        def it_should_find_a_directory_whose_mtime_moved(subject):
+            try:
+                subject.touch('a', 'b')
+                assert subject.snapshot.changed(subject.base) == ['a/b']
+            finally:
+                subject.close()
+
+        def it_should_find_a_directory_which_went_away(subject):
+            try:
+                shutil.rmtree(os.path.join(subject.base, 'a', 'b'))
+                subject.touch('a')
+                assert sorted(subject.snapshot.changed(subject.base)) == \
+                    ['a', 'a/b']
+            finally:
+                subject.close()
+
+        def it_should_list_everything_without_a_snapshot(subject):
+            try:
+                subject.snapshot.discard()
+                assert not os.path.exists(subject.snapshot.filename)
+                assert subject.snapshot.changed(subject.base) == ['']
+            finally:
+                subject.close()
+
+    with context('loaded'):
+        def it_should_read_what_was_saved(subject):
+            try:
+                loaded = DirectorySnapshot(subject.snapshot.filename).load()
+                assert loaded.directories == subject.directories
+                assert loaded.clean
+                assert loaded.changed(subject.base) == []
+            finally:
+                subject.close()
+
+        def it_should_have_no_directories_if_there_is_no_file(subject):
+            try:
+                subject.snapshot.discard()
+                loaded = DirectorySnapshot(subject.snapshot.filename).load()
+                assert loaded.directories is None
+                assert loaded.changed(subject.base) == ['']
+            finally:
+                subject.close()
@@ -0,0 +1,46 @@
+from withspec import describe, context
+from pagepress import shard
+from pagepress.shard import parse_shard, shard_of, shard_output, shard_data
+
+
+with describe(shard):
+
+    def subject():
+        return ['d%d/page%d.md' % (i % 5, i) for i in range(200)]
+
+    with context('shard_of'):
+        def it_should_put_every_key_in_one_shard(subject):
+            for key in subject:
+                assert 1 <= shard_of(key, 4) <= 4
+                assert shard_of(key, 4) == shard_of(key, 4)
+            assert shard_of('page.md', 1) == 1
+
+        def it_should_spread_keys_over_every_shard(subject):
+            counts = {}
+            for key in subject:
+                index = shard_of(key, 4)
+                counts[index] = counts.get(index, 0) + 1
+            assert sorted(counts) == [1, 2, 3, 4]
+            assert min(counts.values()) > 20
+
+    with context('parse_shard'):
+        def it_should_read_i_of_n(subject):
+            assert parse_shard('2/4') == (2, 4)
+            assert parse_shard((2, 4)) == (2, 4)
+            assert parse_shard('') is None
+            assert parse_shard(None) is None
+
+        def it_should_reject_a_shard_out_of_range(subject):
+            for value in ('0/4', '5/4', '2', 'a/b'):
+                try:
+                    parse_shard(value)
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError('%s should be rejected' % value)
+
+    with context('paths'):
+        def it_should_keep_each_shard_beside_the_output(subject):
+            assert shard_output('/site/html/', 2, 4) == \
+                '/site/html.shard-2-of-4'
+            assert shard_data('/site/data', 2, 4).endswith('shard-2-of-4')
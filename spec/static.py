@@ -0,0 +1,182 @@
+import os, errno, shutil, tempfile
+from withspec import describe, context
+from pagepress import static
+from pagepress.static import StaticRegistry, StaticSync
+
+
+with describe(StaticRegistry):
+
+    def subject():
+        return StaticRegistry()
+
+    with context('normalize'):
+        def it_should_resolve_paths_relative_to_the_directory(subject):
+            assert subject.normalize('img/a.png', ('blog', '2020')) == \
+                '/blog/2020/img/a.png'
+            assert subject.normalize('../a.png', ('blog', '2020')) == \
+                '/blog/a.png'
+            assert subject.normalize('./a.png') == '/a.png'
+
+        def it_should_keep_absolute_paths(subject):
+            assert subject.normalize('/img/a.png', ('blog',)) == '/img/a.png'
+
+        def it_should_collapse_slashes_and_stay_in_the_root(subject):
+            assert subject.normalize('//img//a.png') == '/img/a.png'
+            assert subject.normalize('../../a.png', ('blog',)) == '/a.png'
+
+    with context('add'):
+        def it_should_keep_each_path_once_in_order(subject):
+            subject.add('/b.png', 'one.md')
+            subject.add('/a.png', 'one.md')
+            subject.add('/b.png', 'two.md')
+            subject.add('/c.png')
+            assert list(subject) == ['/b.png', '/a.png', '/c.png']
+            assert len(subject) == 3
+            assert '/a.png' in subject
+            assert '/d.png' not in subject
+
+        def it_should_record_who_referenced_what(subject):
+            subject.add('/b.png', 'one.md')
+            subject.add('/a.png', 'one.md')
+            subject.add('/b.png', 'two.md')
+            subject.add('/b.png', 'one.md')
+            assert subject.paths('one.md') == ['/b.png', '/a.png']
+            assert subject.paths('three.md') == []
+            assert subject.referenced_by('/b.png') == ['one.md', 'two.md']
+
+    with context('merge'):
+        def it_should_combine_paths_and_sources(subject):
+            subject.add('/a.png', 'one.md')
+            other = StaticRegistry()
+            other.add('/a.png', 'two.md')
+            other.add('/b.png', 'two.md')
+            other.add('/c.png')
+            subject.merge(other)
+            assert list(subject) == ['/a.png', '/b.png', '/c.png']
+            assert subject.referenced_by('/a.png') == ['one.md', 'two.md']
+            assert subject.paths('two.md') == ['/a.png', '/b.png']
+            assert subject.referenced_by('/c.png') == []
+
+
+class Tree(object):
+    '''A source directory holding a/b.txt, and an empty destination.'''
+    def __init__(self):
+        self.base = tempfile.mkdtemp(prefix='pagepress-spec-')
+        self.source = os.path.join(self.base, 'source')
+        self.destination = os.path.join(self.base, 'html')
+        os.makedirs(os.path.join(self.source, 'a'))
+        with open(self.path('source'), 'w') as fp:
+            fp.write('Static')
+        os.chmod(self.path('source'), 0o640)
+
+    def path(self, directory):
+        return os.path.join(self.base, directory, 'a', 'b.txt')
+
+    def sync(self, method='copy'):
+        return StaticSync(method, jobs=1).sync(self.source, self.destination,
+                                               ['/a/b.txt'])
+
+    def close(self):
+        shutil.rmtree(self.base)
+
+
+class Unsupported(object):
+    '''Stands in for fcntl on a filesystem which can't clone.'''
+    @staticmethod
+    def ioctl(*args):
+        raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+
+
+with describe(StaticSync):
+
+    def subject():
+        return Tree()
+
+    with context('sync'):
+        def it_should_copy_then_skip_an_unchanged_file(subject):
+            try:
+                assert subject.sync() == (['/a/b.txt'], [])
+                with open(subject.path('html')) as fp:
+                    assert fp.read() == 'Static'
+                assert subject.sync() == ([], ['/a/b.txt'])
+            finally:
+                subject.close()
+
+        def it_should_copy_a_file_again_once_it_changes(subject):
+            try:
+                subject.sync()
+                with open(subject.path('source'), 'w') as fp:
+                    fp.write('Changed')
+                assert subject.sync() == (['/a/b.txt'], [])
+                with open(subject.path('html')) as fp:
+                    assert fp.read() == 'Changed'
+            finally:
+                subject.close()
+
+        def it_should_keep_the_mode_bits(subject):
+            try:
+                subject.sync()
+                assert os.stat(subject.path('html')).st_mode & 0o777 == 0o640
+                os.chmod(subject.path('source'), 0o755)
+                assert subject.sync() == (['/a/b.txt'], [])
+                assert os.stat(subject.path('html')).st_mode & 0o777 == 0o755
+            finally:
+                subject.close()
+
+        def it_should_leave_out_a_missing_file(subject):
+            try:
+                os.remove(subject.path('source'))
+                assert subject.sync() == ([], [])
+            finally:
+                subject.close()
+
+    with context('hardlink'):
+        def it_should_link_to_the_source(subject):
+            try:
+                subject.sync('hardlink')
+                assert os.path.samefile(subject.path('source'),
+                                        subject.path('html'))
+                assert subject.sync('hardlink') == ([], ['/a/b.txt'])
+            finally:
+                subject.close()
+
+        def it_should_copy_across_filesystems(subject):
+            link = os.link
+            def cross_device(source, destination):
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            os.link = cross_device
+            try:
+                assert subject.sync('hardlink') == (['/a/b.txt'], [])
+                assert not os.path.samefile(subject.path('source'),
+                                            subject.path('html'))
+                with open(subject.path('html')) as fp:
+                    assert fp.read() == 'Static'
+                assert os.stat(subject.path('html')).st_mode & 0o777 == 0o640
+                assert subject.sync('hardlink') == ([], ['/a/b.txt'])
+            finally:
+                os.link = link
+                subject.close()
+
+    with context('reflink'):
+        def it_should_copy_where_the_filesystem_cannot_clone(subject):
+            fcntl = static.fcntl
+            static.fcntl = Unsupported
+            try:
+                assert subject.sync('reflink') == (['/a/b.txt'], [])
+                with open(subject.path('html')) as fp:
+                    assert fp.read() == 'Static'
+                assert os.stat(subject.path('html')).st_mode & 0o777 == 0o640
+            finally:
+                static.fcntl = fcntl
+                subject.close()
+
+        def it_should_copy_without_fcntl(subject):
+            fcntl = static.fcntl
+            static.fcntl = None
+            try:
+                assert subject.sync('reflink') == (['/a/b.txt'], [])
+                with open(subject.path('html')) as fp:
+                    assert fp.read() == 'Static'
+            finally:
+                static.fcntl = fcntl
+                subject.close()